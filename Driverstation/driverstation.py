@@ -26,6 +26,10 @@ def quit():
 # Construct an argument parser
 parser = argparse.ArgumentParser()
 parser.add_argument("ip_addr", help="IP address of the server")
+parser.add_argument("--rate", type=float, default=50, help="joystick polls per second")
+parser.add_argument("--epsilon", type=float, default=0.01, help="smallest axis change that is published")
+parser.add_argument("--heartbeat", type=float, default=0.25,
+                    help="seconds after which unchanged input is published again, so the robot can detect stale input")
 args = parser.parse_args()
 ip = args.ip_addr
 print(ip)
@@ -49,8 +53,14 @@ joystick = None
 buttons = [False] * 11
 axis_values = [0] * 6
 
+# last published input, see publishJoystick()
+published_buttons = None
+published_axes = None
+published_time = 0
+sequence = 0
+
 def tryToSetupJoystick():
-    global joystick, hasJoysticks, buttons, axis_values, xbc_nt
+    global joystick, hasJoysticks, buttons, axis_values, xbc_nt, published_buttons
     try:
         pygame.joystick.init()
         # Assume only 1 joystick for now
@@ -61,13 +71,44 @@ def tryToSetupJoystick():
         axis_values = [0] * joystick.get_numaxes()
         hasJoysticks = True
 
-        xbc_nt.putBooleanArray("Buttons", buttons)
-        xbc_nt.putNumberArray("Axis", list(axis_values))
+        # publish the new layout on the next poll
+        published_buttons = None
         
     except pygame.error:
         hasJoysticks = False
 
 
+def inputChanged():
+    if published_buttons is None or buttons != published_buttons or len(axis_values) != len(published_axes):
+        return True
+    return any(abs(value - published) > args.epsilon for value, published in zip(axis_values, published_axes))
+
+
+def publishJoystick(now):
+    """
+    Publish the joystick if it changed more than epsilon, or if
+    nothing was published for heartbeat seconds. Sequence is
+    incremented and Timestamp (time.time() of the poll) is set
+    with every publish, the robot can use them to detect stale
+    input and to measure the input latency.
+    """
+    global published_buttons, published_axes, published_time, sequence
+    if not inputChanged() and now - published_time < args.heartbeat:
+        return
+
+    sequence += 1
+    published_buttons = list(buttons)
+    published_axes = list(axis_values)
+    published_time = now
+
+    xbc_nt.putBooleanArray("Buttons", published_buttons)
+    xbc_nt.putNumberArray("Axis", published_axes)
+    xbc_nt.putNumber("Timestamp", time.time())
+    xbc_nt.putNumber("Sequence", sequence)
+    # send it now instead of with the next periodic update
+    NetworkTables.flush()
+
+
 
 # save reference to table for each xbox controller
 xbc_nt = NetworkTables.getTable('DriverStation/XboxController0')
@@ -89,9 +130,10 @@ connected = False
 print("starting")
 loopQuit = False
 
-a = time.perf_counter()
-b = time.perf_counter()
+joystick_retry = 0
+gui_update = 0
 while loopQuit == False:
+    now = time.monotonic()
 
     """
     TODO: Check if values are different for windows/linux
@@ -101,7 +143,11 @@ while loopQuit == False:
          https://robotpy.readthedocs.io/projects/pynetworktables/en/latest/examples.html
     """
 
-    tryToSetupJoystick()
+    # look for a new or unplugged joystick once a second, not on every poll
+    if now >= joystick_retry:
+        if not hasJoysticks or pygame.joystick.get_count() == 0:
+            tryToSetupJoystick()
+        joystick_retry = now + 1
 
 
 
@@ -115,8 +161,7 @@ while loopQuit == False:
         for j in range(len(axis_values)):
             axis_values[j] = joystick.get_axis(j)
 
-        xbc_nt.putBooleanArray("Buttons", buttons)
-        xbc_nt.putNumberArray("Axis", list(axis_values))
+        publishJoystick(now)
 
     
     hasCommunication = NetworkTables.getRemoteAddress() is not None
@@ -162,7 +207,12 @@ while loopQuit == False:
         mode_nt.putBoolean("Disabled", disabled)
         mode_nt.putString("Mode", mode)
 
-    GUI.update()
+    # the window does not need the joystick rate
+    if now >= gui_update:
+        GUI.update()
+        gui_update = now + 1 / 15
+
+    GUI.clock.tick(args.rate)
 
 
 quit()
@@ -0,0 +1,232 @@
+# Measures how fast the Python side of the robot code can run
+# against a simulated MCU, so no robot brain is needed.
+#
+#   python benchmark.py loop --duration 5 --latency 0.0001
+
+import argparse
+import binascii
+import time
+import timeit
+
+import revlib
+from revvy.hardware_dependent.rrrc_transport_sim import RevvyTransportSim, SimulatedMcu
+from revvy.mcu.rrrc_transport import ImmediatePolling, FixedIntervalPolling, ExponentialBackoffPolling, \
+    Command, CommandFrames, ResponseHeader
+from revvy.mcu import checksum
+from revvy.mcu.flight_recorder import FlightRecorder
+from revvy.robot.imu import IMU
+from revvy.robot.ports.motors.dc_motor import DcMotorController
+from revvy.robot.status_updater import McuStatusUpdater
+
+import robotmap
+
+
+POLLING = {
+    'immediate': lambda args: ImmediatePolling(),
+    'fixed': lambda args: FixedIntervalPolling(args.poll_interval),
+    'backoff': lambda args: ExponentialBackoffPolling(args.poll_interval),
+}
+
+
+def create_robot(args):
+    polling = POLLING[args.polling](args)
+    recorder = FlightRecorder(args.record) if args.record else None
+    bot = revlib.RevBot(bus_factory=lambda: RevvyTransportSim(latency=args.latency, polling=polling,
+                                                              worker=args.bus_worker, recorder=recorder))
+    bot._comm_interface.mcu.busy_reads = args.busy_reads
+    return bot
+
+
+def bench_loop(args):
+    '''
+    Runs a teleop-like cycle (status read, arcade drive, LED update)
+    as fast as possible and reports the sustained cycles per second.
+    '''
+    bot = create_robot(args)
+
+    left = revlib.MotorGroup(bot.get_motor(robotmap.LEFT))
+    right = revlib.MotorGroup(bot.get_motor(robotmap.RIGHT))
+    drive = revlib.Drive(left, right)
+    bumper = bot.get_sensor(robotmap.BUMPER, 'bumper_switch')
+    bot.get_sensor(robotmap.ULTRA, 'hcsr04')
+
+    mcu = bot._comm_interface.mcu
+    commands_before = mcu.command_count
+    transfers_before = mcu.transfer_count
+
+    cycles = 0
+    start = time.perf_counter()
+    end = start + args.duration
+    now = start
+    while now < end:
+        bot.update_status()
+        drive.arcadeDrive(0.5, 0.1)
+        bot.set_led_color(0xffff00 if bumper.value else 0xB333FF)
+
+        cycles += 1
+        now = time.perf_counter()
+
+    elapsed = now - start
+    bot.close()
+    commands = mcu.command_count - commands_before
+    transfers = mcu.transfer_count - transfers_before
+    print(f'{cycles} cycles in {elapsed:.2f} s: {cycles / elapsed:.1f} cycles/s, '
+          f'{1e6 * elapsed / cycles:.1f} us/cycle, {commands / cycles:.1f} MCU commands/cycle, '
+          f'{transfers / cycles:.1f} bus transfers/cycle')
+
+    for command, stats in bot._robot_control.ping._transport.busy_stats.items():
+        if stats.busy_commands:
+            print(f'  command 0x{command:02X}: {stats}')
+
+
+def _crc7_bytewise(data, crc=0xFF):
+    # the original implementation, for comparison
+    for b in data:
+        crc = checksum.crc7_table[b ^ ((crc << 1) & 0xFF)]
+    return crc
+
+
+def _create_command_bytewise(op, command, payload=b''):
+    # the original Command.create, for comparison
+    pl = bytearray(6 + len(payload))
+    if payload:
+        pl[6:] = payload
+        high_byte, low_byte = divmod(binascii.crc_hqx(pl[6:], 0xFFFF), 256)
+    else:
+        high_byte = low_byte = 0xFF
+    pl[0:5] = op, command, len(payload), low_byte, high_byte
+    pl[5] = _crc7_bytewise(pl[0:5])
+    return pl
+
+
+def _timeit(name, fn, number):
+    us = 1e6 * min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f'  {name:<40} {us:8.3f} us')
+
+
+def bench_crc(args):
+    '''
+    Compares the per-command checksum and framing overhead
+    of the original and the current implementation.
+    '''
+    number = 20000
+    buffer = bytearray(6 + 255)
+    header = b'\x00\x3c\x00\xff\xff'
+    response_header = b'\x00\x00\xff\xff' + bytes((checksum.crc7(b'\x00\x00\xff\xff'), ))
+    motor_payload = bytes((0x29, 1, 0, 0, 0x48, 0x42, 0, 0, 0, 0) * 2)
+
+    print('header CRC7:')
+    _timeit('original', lambda: _crc7_bytewise(header), number)
+    _timeit('crc7', lambda: checksum.crc7(header), number)
+    _timeit('crc7_header', lambda: checksum.crc7_header(buffer), number)
+    print('Command.create, no payload (status read):')
+    _timeit('original', lambda: _create_command_bytewise(0, 0x3C), number)
+    _timeit('current', lambda: Command.create(0, 0x3C), number)
+    _timeit('prebuilt frame', lambda: CommandFrames.create(0x3C).start, number)
+    print('Command.create, 20 byte payload (motor control):')
+    _timeit('original', lambda: _create_command_bytewise(0, 0x14, motor_payload), number)
+    _timeit('current', lambda: Command.create(0, 0x14, motor_payload), number)
+    _timeit('preallocated buffer', lambda: Command.write_into(buffer, 0, 0x14, motor_payload), number)
+    print('ResponseHeader.create, no payload:')
+    _timeit('current', lambda: ResponseHeader.create(response_header), number)
+
+
+class _StatusBlobSource:
+    # stands in for RevvyControl, returns one of two prebuilt status blobs so every slot changes on every read
+    def __init__(self, mcu):
+        blobs = []
+        for position in (0, 1):
+            for motor in mcu.motors:
+                motor.pos = position
+            mcu.acceleration = mcu.rotation = (position, ) * 3
+            mcu.yaw = (position, position)
+            blobs.append(memoryview(mcu._status_updater_read(b'')))
+        self._blobs = blobs
+        self._idx = 0
+
+        self.changing = True
+
+    def status_updater_read(self):
+        if self.changing:
+            self._idx ^= 1
+        return self._blobs[self._idx]
+
+    def status_updater_control(self, slot, enabled):
+        pass
+
+
+def _read_status_original(updater: McuStatusUpdater, handlers):
+    # the original McuStatusUpdater.read, for comparison
+    data = updater._robot.status_updater_read()
+    idx = 0
+    while idx < len(data):
+        data_start = idx + 2
+        slot, slot_length = data[idx:data_start]
+        idx = data_start + slot_length
+
+        handler = handlers[slot]
+        if handler:
+            handler(data[data_start:idx])
+
+
+def bench_status(args):
+    '''
+    Measures McuStatusUpdater.read with 6 motors, 2 sensors, battery
+    and IMU enabled, with and without the slots changing.
+    '''
+    number = 20000
+    mcu = SimulatedMcu()
+    mcu.enabled_slots.update(range(14))
+    source = _StatusBlobSource(mcu)
+
+    motor = DcMotorController.__new__(DcMotorController)
+    motor._port = None
+    motor._awaiter = None
+    motor._on_status_changed = lambda _: None
+    imu = IMU()
+
+    def raw(data):
+        pass
+
+    updater = McuStatusUpdater(source)
+    original = [None] * 32
+    for slot in range(6):
+        updater.enable_slot(f'motor_{slot + 1}', motor.update_status_values, DcMotorController.status_struct)
+        original[slot] = motor.update_status
+    for slot in ('sensor_1', 'sensor_2', 'battery'):
+        updater.enable_slot(slot, raw)
+        original[updater.mcu_updater_slots[slot]] = raw
+    updater.enable_slot('axl', imu.update_axl_values, IMU.vector_struct)
+    updater.enable_slot('gyro', imu.update_gyro_values, IMU.vector_struct)
+    updater.enable_slot('yaw', imu.update_yaw_values, IMU.yaw_struct)
+    original[11:14] = imu.update_axl_data, imu.update_gyro_data, imu.update_yaw_angles
+
+    print(f'McuStatusUpdater.read, {len(source.status_updater_read())} byte status, every slot changes:')
+    _timeit('original', lambda: _read_status_original(updater, original), number)
+    _timeit('compiled', updater.read, number)
+    source.changing = False
+    print('McuStatusUpdater.read, nothing changes:')
+    _timeit('original', lambda: _read_status_original(updater, original), number)
+    _timeit('compiled', updater.read, number)
+
+
+BENCHMARKS = {
+    'loop': bench_loop,
+    'crc': bench_crc,
+    'status': bench_status,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=BENCHMARKS.keys())
+    parser.add_argument("--duration", type=float, default=3.0, help="how long to run, in seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated delay of each bus transfer, in seconds")
+    parser.add_argument("--busy-reads", type=int, default=0, help="how many times the simulated MCU answers Busy")
+    parser.add_argument("--polling", choices=POLLING.keys(), default='backoff', help="how to wait while the MCU is busy")
+    parser.add_argument("--bus-worker", action="store_true", help="send MCU commands from a separate thread")
+    parser.add_argument("--record", metavar="FILE", help="record the MCU traffic into a flight recorder file")
+    parser.add_argument("--poll-interval", type=float, default=50, help="(initial) polling interval, in microseconds")
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
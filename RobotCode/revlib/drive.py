@@ -11,11 +11,13 @@ class Drive:
 
     def tankDrive(self, leftSpeed: float, rightSpeed: float):
         '''
-        Set speed of motors based on direct left and right inputs
+        Set speed of motors based on direct left and right inputs.
+        All motors are updated with a single MCU command.
         '''
         
-        self.left.set_speed(leftSpeed * SPEED_MULTIPLIER)
-        self.right.set_speed(rightSpeed * SPEED_MULTIPLIER)
+        with self.left.merge(), self.right.merge():
+            self.left.set_speed(leftSpeed * SPEED_MULTIPLIER)
+            self.right.set_speed(rightSpeed * SPEED_MULTIPLIER)
 
     def arcadeDrive(self, xSpeed: float, zRotation: float):
         """Arcade drive method for differential drive platform.
@@ -25,8 +27,9 @@ class Drive:
         
         left_speed = (xSpeed + zRotation) / 2 * SPEED_MULTIPLIER
         right_speed = (xSpeed - zRotation) / 2 * SPEED_MULTIPLIER
-        self.left.set_speed(left_speed)
-        self.right.set_speed(right_speed)
+        with self.left.merge(), self.right.merge():
+            self.left.set_speed(left_speed)
+            self.right.set_speed(right_speed)
         
         
 
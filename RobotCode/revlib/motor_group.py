@@ -1,3 +1,5 @@
+from contextlib import ExitStack
+
 from revvy.robot.ports.motors.dc_motor import DcMotorController
 
 class MotorGroup():
@@ -15,15 +17,32 @@ class MotorGroup():
             else:
                 raise TypeError(f'Port group inputs must be of type DcMotorController')
 
+        # usually all motors share one cache, as they belong to the same robot
+        self._setpoints = []
+        for port in self.ports:
+            if port.setpoints not in self._setpoints:
+                self._setpoints.append(port.setpoints)
+
+    def merge(self):
+        '''
+        Context manager that sends the commands of all motors
+        in the group, made inside the block, as a single MCU command.
+        '''
+        stack = ExitStack()
+        for setpoints in self._setpoints:
+            stack.enter_context(setpoints.merge())
+        return stack
+
     def _do(self, function, inputs=None):
         '''
         Generic fuction that calls a DcMotorController method
         for all ports in the group
         '''
         results = []
-        for port in self.ports:
-            result = getattr(port, function)(inputs)
-            results.append(result)
+        with self.merge():
+            for port in self.ports:
+                result = getattr(port, function)(inputs)
+                results.append(result)
 
     def set_speed(self, speed):
         self._do('set_speed', inputs=speed)
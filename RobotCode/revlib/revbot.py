@@ -2,17 +2,19 @@
 # and instantiates important objects you can use in your
 # robot.py.
 
+from contextlib import contextmanager
+
 from revvy.robot.status_updater import McuStatusUpdater
-from revvy.mcu.commands import BatteryStatus
 from revvy.mcu.rrrc_control import RevvyTransportBase
 from revvy.robot.imu import IMU
+from revvy.robot.telemetry import TelemetryStore
 from revvy.robot.led_ring import RingLed
 from revvy.robot.ports.motor import create_motor_port_handler
 from revvy.robot.ports.sensor import create_sensor_port_handler
 from revvy.hardware_dependent.sound import SoundControlV2
-from revvy.hardware_dependent.rrrc_transport_i2c import RevvyTransportI2C
 
 from revvy.robot.ports.motors.dc_motor import DcMotorController
+from revvy.robot.ports.motors.setpoints import MotorSetpointCache
 from revvy.robot.configurations import Motors
 from revvy.robot.configurations import Sensors
 from revvy.robot.ports.sensors.simple import bumper_switch, hcsr04
@@ -23,9 +25,48 @@ SENSOR_PORTS = ['sensor_1','sensor_2','sensor_3','sensor_4']
 
 class RevBot():
 
-    def __init__(self): 
+    # How many times per second update_status() refreshes a slot.
+    # Slots that are not listed (motors, sensors) are refreshed on every call.
+    STATUS_RATES = {
+        'battery': 5,
+        'axl': 25,
+        'gyro': 25,
+        'yaw': 25,
+    }
+
+    # What RobotRunner publishes under the Telemetry table, and how
+    # many times per second. Keys are groups ('motors', 'sensors',
+    # 'imu', 'battery'), slots ('motor_1') or signals ('motor_1.speed'),
+    # see TelemetryStore.signals.
+    TELEMETRY_RATES = {
+        'motors': 10,
+        'sensors': 10,
+        'imu': 10,
+        'battery': 1,
+    }
+
+    # When True, RobotRunner runs the periodic functions inside
+    # merge_motor_commands(), so all motor setpoints of a cycle are
+    # sent in one command at its end. Only enable it if the periodic
+    # functions don't wait for motor commands (e.g. the awaiter of
+    # set_position()): the held commands are only sent after them.
+    MERGE_PERIODIC_MOTOR_COMMANDS = False
+
+    @staticmethod
+    def _default_bus_factory() -> RevvyTransportBase:
+        from revvy.hardware_dependent.rrrc_transport_i2c import RevvyTransportI2C
+
+        return RevvyTransportI2C(1)
+
+    def __init__(self, bus_factory=None):
+        '''
+        bus_factory :callable: returns the RevvyTransportBase used to talk to the MCU.
+            Defaults to the I2C bus of the robot brain, pass RevvyTransportSim to run without one.
+        '''
+        if bus_factory is None:
+            bus_factory = self._default_bus_factory
 
-        self._comm_interface = RevvyTransportI2C(1)
+        self._comm_interface = bus_factory()
         self._robot_control = self._comm_interface.create_application_control()
         self._ring_led = RingLed(self._robot_control)
 
@@ -35,19 +76,24 @@ class RevBot():
         self._status_updater = McuStatusUpdater(self._robot_control)
         self._status_updater.reset()
 
-        self._battery = BatteryStatus(0, 0, 0)
-        self._imu = IMU()
+        self._telemetry = TelemetryStore()
+        self._imu = IMU(self._telemetry)
+        self._motor_handlers = {}
+        self._sensors = {}
    
         self._motor_ports = create_motor_port_handler(self._robot_control)
+        self._motor_setpoints = MotorSetpointCache.of(self._robot_control)
         self._sensor_ports = create_sensor_port_handler(self._robot_control)
 
         self.disabled = False
 
         # Need to enable battery and IMU
         self._status_updater.enable_slot("battery", self._process_battery_slot)
-        self._status_updater.enable_slot("axl", self._imu.update_axl_data)
-        self._status_updater.enable_slot("gyro", self._imu.update_gyro_data)
-        self._status_updater.enable_slot("yaw", self._imu.update_yaw_angles)
+        self._status_updater.enable_slot("axl", self._imu.update_axl_values, IMU.vector_struct)
+        self._status_updater.enable_slot("gyro", self._imu.update_gyro_values, IMU.vector_struct)
+        self._status_updater.enable_slot("yaw", self._imu.update_yaw_values, IMU.yaw_struct)
+        for slot, rate in self.STATUS_RATES.items():
+            self._status_updater.set_slot_rate(slot, rate)
 
         #set led color to purple on init
         self.set_led_color(0x6600cc)
@@ -59,16 +105,35 @@ class RevBot():
         '''
 
         colors = [color_code for i in range(0,12)]
+        # nothing is sent if the ring already shows this color
         self._ring_led.display_user_frame(colors)
 
+    def set_led_frame(self, colors):
+        '''
+        Shows a frame of an LED animation, one color per LED.
+        Frames are sent at most led_frame_rate times per second,
+        if they come faster only the newest one is shown. Call it
+        as often as you like, update_status() sends the last one.
+        '''
+        self._ring_led.request_frame(colors)
+
+    @property
+    def led_frame_rate(self):
+        return self._ring_led.max_frame_rate
+
+    @led_frame_rate.setter
+    def led_frame_rate(self, rate):
+        self._ring_led.max_frame_rate = rate
+
     def disable(self):
         '''
         This disables all configured motor ports
         '''
-        for m in self._motor_ports:
-            if(m._driver):
-                m.set_speed(0)
-                self._status_updater.disable_slot(f"motor_{m.id}")
+        with self.batch():
+            for m in self._motor_ports:
+                if(m._driver):
+                    m.set_speed(0)
+                    self._status_updater.disable_slot(f"motor_{m.id}")
 
         self.disabled = True
         #self.set_led_color(0xff0000)
@@ -77,9 +142,13 @@ class RevBot():
         '''
         Enable all configured motor ports
         '''
-        for m in self._motor_ports:
-            if(m._driver):
-                self._status_updater.enable_slot(f"motor_{m.id}", m.update_status)
+        with self.batch():
+            for m in self._motor_ports:
+                if(m._driver):
+                    slot = f"motor_{m.id}"
+                    handler = self._motor_handlers.get(slot) \
+                        or self._telemetry.motor_handler(m.id - 1, m.update_status_values)
+                    self._status_updater.enable_slot(slot, handler, DcMotorController.status_struct)
 
         self.disabled = False
         #self.set_led_color(0x6600cc)
@@ -97,8 +166,10 @@ class RevBot():
         # instantiate motor object
         motor = DcMotorController(port_instance, Motors.RevvyMotor['config'])
 
-        # enable port on status updater
-        self._status_updater.enable_slot(port, motor.update_status)
+        # enable port on status updater, values are also kept in the telemetry store
+        handler = self._telemetry.motor_handler(port_instance.id - 1, motor.update_status_values)
+        self._motor_handlers[port] = handler
+        self._status_updater.enable_slot(port, handler, DcMotorController.status_struct)
 
         return motor
 
@@ -121,22 +192,168 @@ class RevBot():
         else:
             raise ValueError(f"Sensor type must be 'bumper_switch' or 'hcsr04'")
 
-        self._status_updater.enable_slot(port, sensor.update_status)
+        self._status_updater.enable_slot(port, self._telemetry.sensor_handler(port_instance.id - 1, sensor))
+        self._sensors[port] = sensor
 
         return sensor
 
+    @contextmanager
+    def batch(self):
+        '''
+        Groups MCU commands so they are sent together:
+
+            with self.batch():
+                self.left.set_speed(50)
+                self.set_led_color(0x00ff00)
+
+        Motor setpoints inside the block are merged into a single
+        command. Commands inside the block don't return values,
+        so only use it for setting things.
+        '''
+        with self._robot_control.batch() as batch, self._motor_setpoints.merge():
+            yield batch
+
+    def merge_motor_commands(self):
+        '''
+        Collects the motor setpoints set inside the block and sends
+        them as one command when it ends:
+
+            with self.merge_motor_commands():
+                self.left.set_speed(50)
+                self.right.set_speed(50)
+
+        Unlike batch(), other commands are sent right away and
+        return their values.
+        '''
+        return self._motor_setpoints.merge()
+
+    @property
+    def motor_bus_time(self):
+        '''
+        Total seconds the motor control commands have spent on the
+        bus. RobotRunner reports the time of each cycle as 'motors'.
+        '''
+        return self._robot_control.bus_time(self._robot_control.set_motor_port_control_value.command_id)
+
+    @property
+    def motor_keep_alive(self):
+        '''
+        Seconds after which an unchanged motor setpoint is sent again.
+        Repeating the same set_speed() sooner does not reach the MCU.
+        None: never resend, 0: always send.
+        '''
+        return self._motor_setpoints.keep_alive
+
+    @motor_keep_alive.setter
+    def motor_keep_alive(self, seconds):
+        self._motor_setpoints.keep_alive = seconds
+
+    def close(self):
+        '''
+        Waits for queued MCU commands to be sent and
+        releases the bus. Call it before exiting.
+        '''
+        self._comm_interface.close()
+
     def play_sound(self,sound_file):
         self._sound.play_sound(sound_file)
 
     def update_status(self):
-        self._status_updater.read()
+        '''
+        Reads the MCU status slots that are due, see STATUS_RATES.
+        Call it once per loop so motor and sensor values are fresh.
+        '''
+        self._ring_led.flush()
+        if self._status_updater.poll():
+            last_update = self._status_updater.last_update
+            self._telemetry.sample_histories(last_update)
+            for slot, sensor in self._sensors.items():
+                if sensor.has_triggers:
+                    sensor.sample_triggers(last_update(slot))
+
+    def set_status_rate(self, slot, rate):
+        '''
+        slot :str: e.g. 'battery', 'yaw' or 'motor_1'
+        rate :number: updates per second, None to update on every call
+        '''
+        self._status_updater.set_slot_rate(slot, rate)
+
+    def status_timestamp(self, slot):
+        '''
+        Returns the time.monotonic() time when the slot was last
+        updated, or None if it wasn't updated yet.
+        '''
+        return self._status_updater.last_update(slot)
+
+    def status_sequence(self, slot):
+        '''
+        Returns how many times the data of the slot has changed.
+        Compare it with an earlier value to see if there is news.
+        '''
+        return self._status_updater.sequence(slot)
+
+    def wait_for_status(self, slot, newer_than, timeout=None):
+        '''
+        Waits until the slot gets a sample newer than the
+        time.monotonic() time newer_than, while another thread
+        calls update_status(). Returns the time of the sample,
+        or None on timeout.
+        '''
+        return self._status_updater.wait_for_sample(slot, newer_than, timeout)
+
+    def add_sensor_trigger(self, sensor, trigger):
+        '''
+        Calls back when something happens to a sensor value,
+        instead of checking the value in every loop, e.g.
+
+            from revvy.robot.ports.sensors import triggers
+
+            self.add_sensor_trigger(self.bumper, triggers.edge(
+                on_rising=lambda: self.set_led_color(0xffff00),
+                on_falling=lambda: self.set_led_color(0xB333FF)))
+            self.add_sensor_trigger(self.ultra, triggers.threshold(
+                20, on_below=self.stop, debounce=3))
+
+        The callbacks run inside update_status(). Returns the
+        trigger, pass it to sensor.remove_trigger() to stop it.
+        '''
+        return sensor.add_trigger(trigger)
+
+    def history(self, signal, length=64):
+        '''
+        Starts recording a status value on every update_status()
+        and returns its SignalHistory, e.g.
+
+            distance = self.history('sensor_2', 16)
+            distance.median(5)      # ultrasonic without the spikes
+            speed = self.history('motor_1.pos', 8)
+            speed.velocity(4)       # degrees / second from the encoder
+            self.history('yaw').mean(0.5)
+
+        See TelemetryStore.signals for the names.
+        '''
+        return self._telemetry.history(signal, length)
 
     def _process_battery_slot(self, data):
         assert len(data) == 4
         main_status, main_percentage, _, motor_percentage = data
 
-        self._battery = BatteryStatus(chargerStatus=main_status, main=main_percentage, motor=motor_percentage)
+        self._telemetry.set_battery(main_status, main_percentage, motor_percentage)
 
     @property
     def battery(self):
-        return self._battery[1]
+        return self._telemetry.battery.main
+
+    @property
+    def telemetry(self):
+        '''
+        All status values of the robot in one TelemetryStore:
+
+            self.telemetry.motors[0].speed
+            self.telemetry.acceleration.x
+            self.telemetry.battery.main
+            snapshot = self.telemetry.snapshot()
+
+        Reading it does not talk to the MCU, call update_status() for that.
+        '''
+        return self._telemetry
@@ -1,25 +1,59 @@
 # SPDX-License-Identifier: GPL-3.0-only
 
+from ctypes import c_char
+
 from smbus2 import i2c_msg, SMBus
 
 from revvy.mcu.rrrc_control import RevvyTransportBase, RevvyControl, BootloaderControl
-from revvy.mcu.rrrc_transport import RevvyTransportInterface, RevvyTransport, TransportException
+from revvy.mcu.rrrc_transport import RevvyTransportInterface, RevvyTransport, TransportException, BusyPolling
+from revvy.mcu.rrrc_worker import RevvyTransportWorker
+from revvy.mcu.flight_recorder import FlightRecorder
 
 
 class RevvyTransportI2CDevice(RevvyTransportInterface):
-    """Low level communication class used to read/write a specific I2C device address"""
+    """Low level communication class used to read/write a specific I2C device address
+
+    Reads go into preallocated buffers: read() uses a ring of buffers, so the returned memoryview stays valid until
+    ring_size more reads are done; read_into() lets the kernel write directly into the caller's buffer."""
+    ring_size = 4
+    max_read_length = 5 + 255  # response header and longest payload
+
     def __init__(self, address, bus):
         self._address = address
         self._bus = bus
+        self._ring = [self._create_read_msg(bytearray(self.max_read_length)) for _ in range(self.ring_size)]
+        self._ring_idx = 0
+        self._read_msgs = {}
 
-    def read(self, length):
+    def _create_read_msg(self, buffer: bytearray):
+        read_msg = i2c_msg.read(self._address, 0)
+        read_msg.buf = (c_char * len(buffer)).from_buffer(buffer)
+        return read_msg, memoryview(buffer)
+
+    def _read(self, read_msg, view, length):
         try:
-            read_msg = i2c_msg.read(self._address, length)
+            read_msg.len = length
             self._bus.i2c_rdwr(read_msg)
-            return read_msg.buf[0:read_msg.len]
+            return view[0:length]
         except TypeError as e:
             raise TransportException(f"Error during reading I2C address 0x{self._address:X}") from e
 
+    def read(self, length):
+        read_msg, view = self._ring[self._ring_idx]
+        self._ring_idx = (self._ring_idx + 1) % self.ring_size
+
+        return self._read(read_msg, view, length)
+
+    def read_into(self, buffer, length):
+        try:
+            _, read_msg, view = self._read_msgs[id(buffer)]
+        except KeyError:
+            read_msg, view = self._create_read_msg(buffer)
+            # keep a reference to the buffer so that its id is not reused
+            self._read_msgs[id(buffer)] = (buffer, read_msg, view)
+
+        return len(self._read(read_msg, view, length))
+
     def write(self, data):
         try:
             write_msg = i2c_msg.write(self._address, data)
@@ -32,11 +66,23 @@ class RevvyTransportI2C(RevvyTransportBase):
     BOOTLOADER_I2C_ADDRESS = 0x2B
     ROBOT_I2C_ADDRESS = 0x2D
 
-    def __init__(self, bus):
+    def __init__(self, bus, polling: BusyPolling = None, worker=False, recorder: FlightRecorder = None):
+        """
+        @param worker: If True, the commands are executed by a RevvyTransportWorker thread
+        @param recorder: If set, the MCU traffic is recorded into it
+        """
         self._bus = SMBus(bus)
+        self._polling = polling
+        self._worker = worker
+        self._recorder = recorder
+        self._workers = []
 
     def _bind(self, address):
-        return RevvyTransport(RevvyTransportI2CDevice(address, self._bus))
+        transport = RevvyTransport(RevvyTransportI2CDevice(address, self._bus), self._polling, self._recorder)
+        if self._worker:
+            transport = RevvyTransportWorker(transport, f'McuBus [0x{address:X}]')
+            self._workers.append(transport)
+        return transport
 
     def create_bootloader_control(self) -> BootloaderControl:
         return BootloaderControl(self._bind(self.BOOTLOADER_I2C_ADDRESS))
@@ -45,4 +91,8 @@ class RevvyTransportI2C(RevvyTransportBase):
         return RevvyControl(self._bind(self.ROBOT_I2C_ADDRESS))
 
     def close(self):
+        for worker in self._workers:
+            worker.exit()
+        if self._recorder:
+            self._recorder.close()
         self._bus.close()
@@ -0,0 +1,337 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import struct
+import time
+
+from revvy.mcu.rrrc_control import RevvyTransportBase, RevvyControl, BootloaderControl
+from revvy.mcu.checksum import crc7, crc16
+from revvy.mcu.rrrc_transport import RevvyTransportInterface, RevvyTransport, Command, ResponseStatus, BusyPolling
+from revvy.mcu.rrrc_worker import RevvyTransportWorker
+from revvy.mcu.flight_recorder import FlightRecorder
+from revvy.mcu.commands import McuOperationMode
+from revvy.utils.functions import clip
+
+
+def _string_list(names):
+    """
+    >>> _string_list(['foo', 'ba'])
+    b'\\x00\\x03foo\\x01\\x02ba'
+    """
+    data = bytearray()
+    for idx, name in enumerate(names):
+        encoded = name.encode('utf-8')
+        data += bytes((idx, len(encoded))) + encoded
+    return bytes(data)
+
+
+class SimulatedMotor:
+    """Very simple motor model: the measured speed follows the last setpoint"""
+    max_speed = 150  # speed at 100% power
+
+    def __init__(self):
+        self.status = 0
+        self.power = 0
+        self.pos = 0.0
+        self.speed = 0.0
+        self._target_pos = None
+
+    def control(self, request_type, data):
+        self._target_pos = None
+        self.status = 0
+        if request_type == 0:
+            (self.power, ) = struct.unpack('<b', data[0:1])
+            self.speed = self.power * self.max_speed / 100
+        elif request_type == 1:
+            (self.speed, ) = struct.unpack_from('<f', data)
+            self.power = int(clip(self.speed * 100 / self.max_speed, -100, 100))
+        elif request_type in (2, 3):
+            (position, ) = struct.unpack_from('<l', data)
+            self._target_pos = position if request_type == 2 else self.pos + position
+            self.speed = self.max_speed if self._target_pos > self.pos else -self.max_speed
+
+    def step(self, dt):
+        self.pos += self.speed * dt
+        if self._target_pos is not None:
+            if (self.speed > 0) == (self.pos >= self._target_pos):
+                self.pos = self._target_pos
+                self.speed = 0.0
+                self._target_pos = None
+                self.status = 2  # MotorStatus.GOAL_REACHED
+
+    def status_bytes(self):
+        return struct.pack('<bblf', self.status, self.power, int(self.pos), self.speed)
+
+
+class SimulatedMcu:
+    """In-process model of the robot MCU
+
+    Implements the command protocol (header CRC7, payload CRC16, Busy/Pending states) and enough of the command
+    set to configure ports and read the status updater slots. Sensor, battery and IMU values are plain attributes
+    that can be changed from the outside to feed the robot code."""
+
+    motor_port_types = ['NotConfigured', 'DcMotor']
+    sensor_port_types = ['NotConfigured', 'BumperSwitch', 'HC_SR04', 'EV3']
+    ring_led_scenarios = ['Off', 'UserFrame', 'ColorWheel', 'ColorFade', 'BusyIndicator', 'BreathingGreen',
+                          'Siren', 'TrafficLight']
+    motor_port_count = 6
+    sensor_port_count = 4
+    ring_led_count = 12
+
+    def __init__(self, hardware_version='2.0', firmware_version='0.1.0',
+                 operation_mode=McuOperationMode.APPLICATION, busy_reads=0, pending_commands=()):
+        """
+        @param busy_reads: how many header reads are answered with Busy after each write
+        @param pending_commands: ids of the commands that respond with Pending before returning the result
+        """
+        self.hardware_version = hardware_version
+        self.firmware_version = firmware_version
+        self.operation_mode = operation_mode
+        self.busy_reads = busy_reads
+        self.pending_commands = set(pending_commands)
+
+        self.motors = [SimulatedMotor() for _ in range(self.motor_port_count)]
+        self.motor_types = [0] * self.motor_port_count
+        self.sensor_types = [0] * self.sensor_port_count
+        self.sensor_values = [b''] * self.sensor_port_count
+        self.battery = (1, 100, 0, 100)
+        self.acceleration = (0, 0, 0)
+        self.rotation = (0, 0, 0)
+        self.yaw = (0, 0)
+        self.ring_led_scenario = 5
+        self.ring_led_frame = b''
+
+        self.enabled_slots = set()
+        self.command_count = 0
+        self.transfer_count = 0
+
+        self._handlers = {
+            0x00: self._ping,
+            0x01: lambda _: self.hardware_version.encode('utf-8'),
+            0x02: lambda _: self.firmware_version.encode('utf-8'),
+            0x04: self._ping,
+            0x05: self._ping,
+            0x06: lambda _: bytes((self.operation_mode.value, )),
+            0x10: lambda _: bytes((self.motor_port_count, )),
+            0x11: lambda _: _string_list(self.motor_port_types),
+            0x12: self._set_motor_port_type,
+            0x13: self._ping,
+            0x14: self._motor_control,
+            0x20: lambda _: bytes((self.sensor_port_count, )),
+            0x21: lambda _: _string_list(self.sensor_port_types),
+            0x22: self._set_sensor_port_type,
+            0x23: self._ping,
+            0x24: lambda _: b'',
+            0x30: lambda _: _string_list(self.ring_led_scenarios),
+            0x31: self._set_ring_led_scenario,
+            0x32: lambda _: bytes((self.ring_led_count, )),
+            0x33: self._set_ring_led_frame,
+            0x3A: self._status_updater_reset,
+            0x3B: self._status_updater_control,
+            0x3C: self._status_updater_read,
+            0x3D: lambda _: (0).to_bytes(4, byteorder='little'),
+            0x3E: lambda _: b'',
+            0x3F: self._ping,
+            0x40: self._ping,
+        }
+
+        self._last_update = time.monotonic()
+        self._response = self._header(ResponseStatus.Ok)
+        self._busy_remaining = 0
+        self._pending_result = None
+
+    # protocol handling
+
+    @staticmethod
+    def _header(status: ResponseStatus, payload=b''):
+        if payload:
+            checksum = crc16(payload)
+        else:
+            checksum = 0xFFFF
+        header = struct.pack('<BBH', status.value, len(payload), checksum)
+        return header + bytes((crc7(header), )) + payload
+
+    def write(self, data):
+        self.transfer_count += 1
+        data = bytes(data)
+        self._busy_remaining = self.busy_reads
+
+        if len(data) < 6 or crc7(data[0:5]) != data[5]:
+            self._response = self._header(ResponseStatus.Error_CommandIntegrityError)
+            return
+
+        op, command, payload_length, checksum = struct.unpack('<BBBH', data[0:5])
+        payload = data[6:]
+        if payload_length != len(payload):
+            self._response = self._header(ResponseStatus.Error_PayloadLengthError)
+        elif payload_length and checksum != crc16(payload):
+            self._response = self._header(ResponseStatus.Error_PayloadIntegrityError)
+        elif op == Command.OpStart:
+            self._response = self._start(command, payload)
+        elif op == Command.OpGetResult:
+            self._response = self._get_result()
+        elif op == Command.OpCancel:
+            self._pending_result = None
+            self._response = self._header(ResponseStatus.Ok)
+        else:
+            self._response = self._header(ResponseStatus.Error_UnknownOperation)
+
+    def read(self, length):
+        self.transfer_count += 1
+        if self._busy_remaining > 0:
+            self._busy_remaining -= 1
+            response = self._header(ResponseStatus.Busy)
+        else:
+            response = self._response
+
+        return response[0:length]
+
+    def _start(self, command, payload):
+        self.command_count += 1
+        handler = self._handlers.get(command)
+        if handler is None:
+            return self._header(ResponseStatus.Error_UnknownCommand)
+
+        try:
+            result = self._header(ResponseStatus.Ok, handler(payload))
+        except (IndexError, ValueError, struct.error):
+            result = self._header(ResponseStatus.Error_CommandError)
+
+        if command in self.pending_commands:
+            self._pending_result = result
+            return self._header(ResponseStatus.Pending)
+
+        return result
+
+    def _get_result(self):
+        result, self._pending_result = self._pending_result, None
+        if result is None:
+            return self._header(ResponseStatus.Error_InvalidOperation)
+        return result
+
+    # command implementations
+
+    @staticmethod
+    def _ping(_):
+        return b''
+
+    def _set_motor_port_type(self, payload):
+        port, port_type = payload
+        self.motor_types[port - 1] = port_type
+        self.motors[port - 1] = SimulatedMotor()
+        return b''
+
+    def _set_sensor_port_type(self, payload):
+        port, port_type = payload
+        self.sensor_types[port - 1] = port_type
+        self.sensor_values[port - 1] = {
+            'BumperSwitch': b'\x00\x00',
+            'HC_SR04': struct.pack('<l', 100),
+        }.get(self.sensor_port_types[port_type], b'')
+        return b''
+
+    def _motor_control(self, payload):
+        idx = 0
+        while idx < len(payload):
+            header = payload[idx]
+            port_idx, length = header & 0x07, header >> 3
+            data = payload[idx + 1:idx + 1 + length]
+            self.motors[port_idx].control(data[0], data[1:])
+            idx += 1 + length
+        return b''
+
+    def _set_ring_led_scenario(self, payload):
+        (self.ring_led_scenario, ) = payload
+        return b''
+
+    def _set_ring_led_frame(self, payload):
+        self.ring_led_frame = payload
+        return b''
+
+    def _status_updater_reset(self, _):
+        self.enabled_slots.clear()
+        return b''
+
+    def _status_updater_control(self, payload):
+        slot, is_enabled = payload
+        if is_enabled:
+            self.enabled_slots.add(slot)
+        else:
+            self.enabled_slots.discard(slot)
+        return b''
+
+    def _slot_data(self, slot):
+        if slot < 6:
+            return self.motors[slot].status_bytes()
+        elif slot < 10:
+            return self.sensor_values[slot - 6]
+        elif slot == 10:
+            return bytes(self.battery)
+        elif slot == 11:
+            return struct.pack('<hhh', *self.acceleration)
+        elif slot == 12:
+            return struct.pack('<hhh', *self.rotation)
+        elif slot == 13:
+            return struct.pack('<ll', *self.yaw)
+        return None
+
+    def _status_updater_read(self, _):
+        now = time.monotonic()
+        dt, self._last_update = now - self._last_update, now
+        for motor in self.motors:
+            motor.step(dt)
+
+        data = bytearray()
+        for slot in sorted(self.enabled_slots):
+            slot_data = self._slot_data(slot)
+            if slot_data is not None:
+                data += bytes((slot, len(slot_data))) + slot_data
+        return bytes(data)
+
+
+class RevvyTransportSimDevice(RevvyTransportInterface):
+    """Simulated counterpart of RevvyTransportI2CDevice, optionally adding a fixed delay to every transfer"""
+    def __init__(self, mcu: SimulatedMcu, latency=0.0):
+        self._mcu = mcu
+        self.latency = latency
+
+    def read(self, length):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._mcu.read(length)
+
+    def write(self, data):
+        if self.latency:
+            time.sleep(self.latency)
+        self._mcu.write(data)
+
+
+class RevvyTransportSim(RevvyTransportBase):
+    """Drop-in replacement for RevvyTransportI2C that talks to in-process simulated MCUs"""
+    def __init__(self, latency=0.0, mcu: SimulatedMcu = None, polling: BusyPolling = None, worker=False,
+                 recorder: FlightRecorder = None):
+        self.mcu = mcu or SimulatedMcu()
+        self.bootloader = SimulatedMcu(operation_mode=McuOperationMode.BOOTLOADER)
+        self.latency = latency
+        self._polling = polling
+        self._worker = worker
+        self._recorder = recorder
+        self._workers = []
+
+    def _bind(self, mcu):
+        transport = RevvyTransport(RevvyTransportSimDevice(mcu, self.latency), self._polling, self._recorder)
+        if self._worker:
+            transport = RevvyTransportWorker(transport, 'McuBus [sim]')
+            self._workers.append(transport)
+        return transport
+
+    def create_bootloader_control(self) -> BootloaderControl:
+        return BootloaderControl(self._bind(self.bootloader))
+
+    def create_application_control(self) -> RevvyControl:
+        return RevvyControl(self._bind(self.mcu))
+
+    def close(self):
+        for worker in self._workers:
+            worker.exit()
+        if self._recorder:
+            self._recorder.close()
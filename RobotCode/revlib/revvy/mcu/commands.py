@@ -9,7 +9,7 @@ from enum import Enum
 from revvy.utils.functions import split
 from revvy.utils.logger import get_logger
 from revvy.utils.version import Version, FormatError
-from revvy.mcu.rrrc_transport import RevvyTransport, Response, ResponseStatus
+from revvy.mcu.rrrc_transport import RevvyTransport, Response, ResponseStatus, CommandFrames
 
 
 class UnknownCommandError(Exception):
@@ -19,9 +19,20 @@ class UnknownCommandError(Exception):
 class Command:
     """A generic command towards the MCU"""
 
+    # If True, the response is read into a buffer owned by the command and parse_response receives a memoryview
+    # that is only valid until the command is sent again
+    zero_copy = False
+
+    # If True, the command is posted to the transport: a RevvyTransportWorker queues it and returns without waiting
+    # for the response, failures are logged by the worker. Only for commands whose response is not used.
+    fire_and_forget = False
+
     def __init__(self, transport: RevvyTransport):
         self._transport = transport
         self._command_byte = self.command_id
+        self._frames = CommandFrames.create(self._command_byte)
+        self._receive_buffer = bytearray(5 + 255) if self.zero_copy else None
+        self._send_command = transport.post if self.fire_and_forget else transport.send_command
 
         self._log = get_logger(f'{type(self).__name__} [id={self._command_byte}]')
 
@@ -43,7 +54,10 @@ class Command:
 
         @type payload: iterable
         """
-        response = self._transport.send_command(self._command_byte, payload)
+        response = self._send_command(self._command_byte, payload, self._frames, self._receive_buffer)
+        if response is None:
+            # queued into a CommandBatch or posted to a worker, the response is reported there
+            return None
 
         try:
             return self._process(response)
@@ -183,6 +197,8 @@ class SetSensorPortTypeCommand(SetPortTypeCommand):
 
 
 class SetRingLedScenarioCommand(Command):
+    fire_and_forget = True
+
     @property
     def command_id(self): return 0x31
 
@@ -200,10 +216,17 @@ class GetRingLedAmountCommand(Command):
 
 
 class SendRingLedUserFrameCommand(Command):
+    fire_and_forget = True
+
     @property
     def command_id(self): return 0x33
 
     def __call__(self, colors):
+        """
+        @param colors: list of 24 bit RGB colors, or the already converted RGB565 payload (bytes)
+        """
+        if isinstance(colors, (bytes, bytearray)):
+            return self._send(colors)
         rgb565_values = map(rgb_to_rgb565_bytes, colors)
         led_bytes = struct.pack(f"<{len(colors)}H", *rgb565_values)
         return self._send(led_bytes)
@@ -236,6 +259,8 @@ class ReadSensorPortInfoCommand(Command):
 
 
 class SetMotorPortControlCommand(Command):
+    fire_and_forget = True
+
     @property
     def command_id(self): return 0x14
 
@@ -266,11 +291,13 @@ class McuStatusUpdater_ControlCommand(Command):
 
 
 class McuStatusUpdater_ReadCommand(Command):
+    zero_copy = True
+
     @property
     def command_id(self): return 0x3C
 
     def parse_response(self, payload):
-        """Return the raw response"""
+        """Return the raw response, as a memoryview that is valid until the next read"""
         return payload
 
 
@@ -0,0 +1,221 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Records MCU commands and responses into a fixed-size, memory-mapped ring file
+
+The file never grows and is rewritten in place, so it can be left enabled on the SD card. Decode it with
+
+    python -m revvy.mcu.flight_recorder decode <file>
+
+Every FlightRecorder opened on the file starts a new session. The start times are time.monotonic() values, so they are
+only comparable within a session: the first record of each session marks its start with the wall-clock time.
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import time
+from datetime import datetime
+
+# file header: magic, version, record size, record count, sequence number of the next record, current session
+_header = struct.Struct('<4sHHIII')
+_magic = b'RVFR'
+_version = 2
+
+# record header: sequence number, session, start time (time.monotonic()), duration, command, status,
+# original payload length, original response length. Sequence number 0 marks an empty record.
+_record = struct.Struct('<IIdfBBBB')
+_next_sequence = struct.Struct('<I')
+_next_sequence_offset = 12
+
+# payload of the session start record: time.time() when the session started
+_session_start = struct.Struct('<d')
+
+STATUS_EXCEPTION = 0xFF  # the command raised instead of returning a response
+STATUS_SESSION = 0xFE  # not a command: the recorder was opened, a new session starts
+
+
+class FlightRecorder:
+    """Ring of fixed-size binary records, one for each command sent through a RevvyTransport
+
+    Payloads and responses longer than the space in a record are truncated, the original lengths are kept.
+    record() is called by RevvyTransport with the bus lock held, so it does not lock on its own. It packs the record
+    directly into the mapped file and only allocates for payloads that are not bytes-like."""
+
+    def __init__(self, path, record_count=4096, record_size=64):
+        if record_size < _record.size + 2 * _session_start.size:
+            raise ValueError(f'Record size must be at least {_record.size + 2 * _session_start.size} bytes')
+
+        self.path = path
+        file_size = _header.size + record_count * record_size
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != file_size:
+                os.ftruncate(fd, file_size)
+            self._mm = mmap.mmap(fd, file_size)
+        finally:
+            os.close(fd)
+
+        magic, version, size, count, sequence, session = _header.unpack_from(self._mm, 0)
+        if (magic, version, size, count) != (_magic, _version, record_size, record_count):
+            # new file or different layout: start over
+            self._mm[:] = bytes(file_size)
+            sequence = 1
+            session = 0
+
+        # the sequence numbers continue, the timestamps of the previous session are not comparable with this one's
+        session += 1
+        _header.pack_into(self._mm, 0, _magic, _version, record_size, record_count, sequence, session)
+
+        self._record_count = record_count
+        self._record_size = record_size
+        self._data_size = (record_size - _record.size) // 2  # space for payload and response, each
+        self._sequence = sequence
+        self._session = session
+
+        self.record(0, _session_start.pack(time.time()), STATUS_SESSION, b'', time.monotonic(), 0.0)
+
+    def record(self, command, payload, status, response, start_time, duration):
+        """
+        Store a command and its response
+
+        @param status: the ResponseStatus value, STATUS_EXCEPTION or STATUS_SESSION
+        @param start_time: time.monotonic() when the command was started
+        @param duration: how long the command took [seconds]
+        """
+        mm = self._mm
+        sequence = self._sequence
+        self._sequence = sequence + 1
+
+        offset = _header.size + (sequence % self._record_count) * self._record_size
+        payload_length = len(payload)
+        response_length = len(response)
+        _record.pack_into(mm, offset, sequence, self._session, start_time, duration, command, status,
+                          payload_length, response_length)
+
+        data_size = self._data_size
+        offset += _record.size
+        if payload_length:
+            if not isinstance(payload, (bytes, bytearray, memoryview)):
+                payload = bytes(payload)
+            if payload_length > data_size:
+                payload = memoryview(payload)[0:data_size]
+                payload_length = data_size
+            mm[offset:offset + payload_length] = payload
+
+        offset += data_size
+        if response_length:
+            if response_length > data_size:
+                response = memoryview(response)[0:data_size]
+                response_length = data_size
+            mm[offset:offset + response_length] = response
+
+        _next_sequence.pack_into(mm, _next_sequence_offset, self._sequence)
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        if not self._mm.closed:
+            self._mm.flush()
+            self._mm.close()
+
+
+def read_records(path):
+    """Read the records of a ring file, oldest first
+
+    Returns a list of (sequence, session, start_time, duration, command, status, payload, response) tuples, payload
+    and response may be truncated."""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    magic, version, record_size, record_count, _, _ = _header.unpack_from(data, 0)
+    if magic != _magic or version != _version:
+        raise ValueError(f'{path} is not a flight recorder file')
+
+    data_size = (record_size - _record.size) // 2
+    records = []
+    for idx in range(record_count):
+        offset = _header.size + idx * record_size
+        sequence, session, start_time, duration, command, status, payload_length, response_length = \
+            _record.unpack_from(data, offset)
+        if sequence:
+            payload_start = offset + _record.size
+            response_start = payload_start + data_size
+            payload = data[payload_start:payload_start + min(payload_length, data_size)]
+            response = data[response_start:response_start + min(response_length, data_size)]
+            records.append((sequence, session, start_time, duration, command, status, payload, response))
+
+    records.sort()
+    return records
+
+
+def _command_names():
+    from revvy.mcu.commands import Command
+
+    names = {}
+    pending = list(Command.__subclasses__())
+    while pending:
+        cls = pending.pop()
+        pending += cls.__subclasses__()
+        try:
+            names[cls.command_id.fget(None)] = cls.__name__
+        except NotImplementedError:
+            pass  # abstract command
+    return names
+
+
+def _status_name(status):
+    from revvy.mcu.rrrc_transport import ResponseStatus
+
+    if status == STATUS_EXCEPTION:
+        return 'Exception'
+    if status == STATUS_SESSION:
+        return 'Session'
+    try:
+        return ResponseStatus(status).name
+    except ValueError:
+        return f'Unknown({status})'
+
+
+def decode(path, out=print):
+    """Print the records of a ring file as a timeline, relative to the oldest record of each session"""
+    records = read_records(path)
+    if not records:
+        out('No records')
+        return
+
+    names = _command_names()
+    first = None
+    previous_sequence = None
+    previous_session = None
+    for sequence, session, start_time, duration, command, status, payload, response in records:
+        if previous_sequence is not None and sequence != previous_sequence + 1:
+            out(f'--- {sequence - previous_sequence - 1} records overwritten or lost ---')
+        previous_sequence = sequence
+
+        if session != previous_session:
+            # the clock of each session starts over, so does the timeline
+            previous_session = session
+            first = start_time
+            if status == STATUS_SESSION and len(payload) == _session_start.size:
+                started = datetime.fromtimestamp(_session_start.unpack(payload)[0])
+                out(f'=== session {session}, started at {started:%Y-%m-%d %H:%M:%S} ===')
+                continue
+            out(f'=== session {session}, start overwritten ===')
+
+        name = names.get(command, f'0x{command:02X}')
+        out(f'{start_time - first:12.6f} #{sequence:<8} {name:<36} {_status_name(status):<28} '
+            f'{duration * 1000:7.3f} ms  payload={payload.hex()} response={response.hex()}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flight recorder tools')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    decode_parser = subparsers.add_parser('decode', help='print the recorded commands as a timeline')
+    decode_parser.add_argument('file')
+    args = parser.parse_args()
+
+    if args.action == 'decode':
+        decode(args.file)
@@ -22,6 +22,9 @@ class BootloaderControl:
 
 class RevvyControl:
     def __init__(self, transport: RevvyTransport):
+        self.batch = transport.batch
+        self.bus_time = transport.bus_time
+
         self.ping = PingCommand(transport)
 
         self.set_master_status = SetMasterStatusCommand(transport)
@@ -1,59 +1,19 @@
 # SPDX-License-Identifier: GPL-3.0-only
 
 import struct
-import binascii
+import time
+from collections import defaultdict
 from enum import Enum
-from threading import Lock
-from typing import NamedTuple
+from functools import lru_cache
+from threading import Lock, local
+from typing import NamedTuple, Optional, List
 
+from revvy.mcu.checksum import crc7_header, crc16
+from revvy.mcu.flight_recorder import FlightRecorder, STATUS_EXCEPTION
 from revvy.utils.functions import retry
+from revvy.utils.logger import get_logger, LogLevel
 from revvy.utils.stopwatch import Stopwatch
 
-crc7_table = (
-    0x00, 0x09, 0x12, 0x1b, 0x24, 0x2d, 0x36, 0x3f,
-    0x48, 0x41, 0x5a, 0x53, 0x6c, 0x65, 0x7e, 0x77,
-    0x19, 0x10, 0x0b, 0x02, 0x3d, 0x34, 0x2f, 0x26,
-    0x51, 0x58, 0x43, 0x4a, 0x75, 0x7c, 0x67, 0x6e,
-    0x32, 0x3b, 0x20, 0x29, 0x16, 0x1f, 0x04, 0x0d,
-    0x7a, 0x73, 0x68, 0x61, 0x5e, 0x57, 0x4c, 0x45,
-    0x2b, 0x22, 0x39, 0x30, 0x0f, 0x06, 0x1d, 0x14,
-    0x63, 0x6a, 0x71, 0x78, 0x47, 0x4e, 0x55, 0x5c,
-    0x64, 0x6d, 0x76, 0x7f, 0x40, 0x49, 0x52, 0x5b,
-    0x2c, 0x25, 0x3e, 0x37, 0x08, 0x01, 0x1a, 0x13,
-    0x7d, 0x74, 0x6f, 0x66, 0x59, 0x50, 0x4b, 0x42,
-    0x35, 0x3c, 0x27, 0x2e, 0x11, 0x18, 0x03, 0x0a,
-    0x56, 0x5f, 0x44, 0x4d, 0x72, 0x7b, 0x60, 0x69,
-    0x1e, 0x17, 0x0c, 0x05, 0x3a, 0x33, 0x28, 0x21,
-    0x4f, 0x46, 0x5d, 0x54, 0x6b, 0x62, 0x79, 0x70,
-    0x07, 0x0e, 0x15, 0x1c, 0x23, 0x2a, 0x31, 0x38,
-    0x41, 0x48, 0x53, 0x5a, 0x65, 0x6c, 0x77, 0x7e,
-    0x09, 0x00, 0x1b, 0x12, 0x2d, 0x24, 0x3f, 0x36,
-    0x58, 0x51, 0x4a, 0x43, 0x7c, 0x75, 0x6e, 0x67,
-    0x10, 0x19, 0x02, 0x0b, 0x34, 0x3d, 0x26, 0x2f,
-    0x73, 0x7a, 0x61, 0x68, 0x57, 0x5e, 0x45, 0x4c,
-    0x3b, 0x32, 0x29, 0x20, 0x1f, 0x16, 0x0d, 0x04,
-    0x6a, 0x63, 0x78, 0x71, 0x4e, 0x47, 0x5c, 0x55,
-    0x22, 0x2b, 0x30, 0x39, 0x06, 0x0f, 0x14, 0x1d,
-    0x25, 0x2c, 0x37, 0x3e, 0x01, 0x08, 0x13, 0x1a,
-    0x6d, 0x64, 0x7f, 0x76, 0x49, 0x40, 0x5b, 0x52,
-    0x3c, 0x35, 0x2e, 0x27, 0x18, 0x11, 0x0a, 0x03,
-    0x74, 0x7d, 0x66, 0x6f, 0x50, 0x59, 0x42, 0x4b,
-    0x17, 0x1e, 0x05, 0x0c, 0x33, 0x3a, 0x21, 0x28,
-    0x5f, 0x56, 0x4d, 0x44, 0x7b, 0x72, 0x69, 0x60,
-    0x0e, 0x07, 0x1c, 0x15, 0x2a, 0x23, 0x38, 0x31,
-    0x46, 0x4f, 0x54, 0x5d, 0x62, 0x6b, 0x70, 0x79)
-
-
-def crc7(data, crc=0xFF):
-    """
-    >>> crc7(b'foobar')
-    16
-    """
-    for b in data:
-        crc = crc7_table[b ^ ((crc << 1) & 0xFF)]
-    return crc
-
-
 class TransportException(Exception):
     pass
 
@@ -62,6 +22,12 @@ class RevvyTransportInterface:
     def read(self, length): raise NotImplementedError()
     def write(self, data): raise NotImplementedError()
 
+    def read_into(self, buffer, length):
+        """Read length bytes into the beginning of buffer, return the number of bytes read"""
+        data = self.read(length)
+        buffer[0:len(data)] = data
+        return len(data)
+
 
 class Command:
     OpStart = 0
@@ -76,21 +42,48 @@ class Command:
             raise ValueError(f'Payload is too long ({payload_length} bytes, 255 allowed)')
 
         pl = bytearray(6 + payload_length)
+        Command.write_into(pl, op, command, payload)
+
+        return pl
+
+    @staticmethod
+    def write_into(buffer: bytearray, op, command, payload=b''):
+        """
+        Build the command frame in a preallocated buffer and return its length
+
+        >>> buffer = bytearray(8)
+        >>> Command.write_into(buffer, Command.OpStart, 2, (1, 2))
+        8
+        >>> buffer == Command.create(Command.OpStart, 2, (1, 2))
+        True
+        """
+        payload_length = len(payload)
+        if payload_length > 255:
+            raise ValueError(f'Payload is too long ({payload_length} bytes, 255 allowed)')
 
         if payload:
-            pl[6:] = payload
-            payload_checksum = binascii.crc_hqx(pl[6:], 0xFFFF)
-            high_byte, low_byte = divmod(payload_checksum, 256)  # get bytes of unsigned short
+            buffer[6:6 + payload_length] = payload
+            if not isinstance(payload, (bytes, bytearray, memoryview)):
+                payload = buffer[6:6 + payload_length]
+            payload_checksum = crc16(payload)
+
+            # fill header
+            buffer[0] = op
+            buffer[1] = command
+            buffer[2] = payload_length
+            buffer[3] = payload_checksum & 0xFF
+            buffer[4] = payload_checksum >> 8
         else:
-            high_byte = low_byte = 0xFF
+            buffer[0] = op
+            buffer[1] = command
+            buffer[2] = 0
+            buffer[3] = 0xFF
+            buffer[4] = 0xFF
 
-        # fill header
-        pl[0:5] = op, command, payload_length, low_byte, high_byte
+        # calculate header checksum, in place
+        buffer[5] = crc7_header(buffer)
 
-        # calculate header checksum
-        pl[5] = crc7(pl[0:5])
-
-        return pl
+        return 6 + payload_length
 
     @staticmethod
     def start(command, payload: bytes):
@@ -113,6 +106,22 @@ class Command:
         return Command.create(Command.OpCancel, command)
 
 
+class CommandFrames(NamedTuple):
+    """The immutable frames of a command: Start without payload and GetResult"""
+    start: bytes
+    get_result: bytes
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def create(command):
+        """
+        >>> CommandFrames.create(2).get_result
+        b'\\x02\\x02\\x00\\xff\\xff='
+        """
+        return CommandFrames(start=bytes(Command.start(command, b'')),
+                             get_result=bytes(Command.get_result(command)))
+
+
 class ResponseStatus(Enum):
     Ok = 0
     Busy = 1
@@ -135,28 +144,28 @@ class ResponseHeader(NamedTuple):
     status: ResponseStatus
     payload_length: int
     payload_checksum: int
-    raw: bytes
 
     @staticmethod
     def create(data: bytes):
+        # data may be a reused read buffer, the header is parsed in place and not kept
         try:
-            header_bytes = data[0:4]
-            if crc7(header_bytes) != data[4]:
+            if crc7_header(data, 4) != data[4]:
                 raise ValueError('Header checksum mismatch')
 
-            status, _payload_length, _payload_checksum = struct.unpack('<BBH', header_bytes)
+            status, _payload_length, _payload_checksum = struct.unpack_from('<BBH', data)
             return ResponseHeader(status=ResponseStatus(status),
                                   payload_length=_payload_length,
-                                  payload_checksum=_payload_checksum,
-                                  raw=header_bytes)
+                                  payload_checksum=_payload_checksum)
         except IndexError as e:
             raise ValueError('Header too short') from e
 
     def validate_payload(self, payload):
-        return self.payload_checksum == binascii.crc_hqx(payload, 0xFFFF)
+        return self.payload_checksum == crc16(payload)
 
     def is_same_as(self, response_header):
-        return self.raw == response_header
+        return self.status.value == response_header[0] \
+            and self.payload_length == response_header[1] \
+            and self.payload_checksum == response_header[2] | response_header[3] << 8
 
 
 class Response(NamedTuple):
@@ -164,68 +173,299 @@ class Response(NamedTuple):
     payload: bytes
 
 
+class BusyPolling:
+    """Strategy that decides how long to wait before reading the response again while the MCU is busy"""
+    def wait(self, attempt):
+        """
+        Called after the attempt-th (starting at 0) consecutive Busy response of a command
+
+        @param attempt: The number of Busy responses received for the current command before this one
+        """
+        raise NotImplementedError
+
+
+class ImmediatePolling(BusyPolling):
+    """Read again without waiting. Lowest latency, but keeps the CPU and the bus busy"""
+    def wait(self, attempt):
+        pass
+
+
+class FixedIntervalPolling(BusyPolling):
+    """Wait a fixed amount of time between reads"""
+    def __init__(self, interval_us):
+        self._interval = interval_us / 1e6
+
+    def wait(self, attempt):
+        time.sleep(self._interval)
+
+
+class ExponentialBackoffPolling(BusyPolling):
+    """
+    Start with a short wait and double it on every Busy response, up to a limit
+
+    >>> [ExponentialBackoffPolling(50, 300).delay(i) for i in range(5)]
+    [5e-05, 0.0001, 0.0002, 0.0003, 0.0003]
+    """
+    def __init__(self, initial_us=50, max_us=1000, factor=2):
+        self._initial = initial_us / 1e6
+        self._max = max_us / 1e6
+        self._factor = factor
+
+    def delay(self, attempt):
+        return min(self._initial * self._factor ** attempt, self._max)
+
+    def wait(self, attempt):
+        time.sleep(self.delay(attempt))
+
+
+class BusyWaitStats:
+    """Busy-wait statistics of a single command"""
+    __slots__ = ('commands', 'busy_commands', 'busy_reads', 'wait_time', 'max_wait_time', 'bus_time')
+
+    def __init__(self):
+        self.commands = 0  # number of times the command was sent
+        self.busy_commands = 0  # number of times the MCU responded with Busy at least once
+        self.busy_reads = 0  # total number of Busy responses
+        self.wait_time = 0.0  # total time spent waiting for the MCU [seconds]
+        self.max_wait_time = 0.0
+        self.bus_time = 0.0  # total time the command took on the bus, including retries and busy waits [seconds]
+
+    @property
+    def mean_wait_time(self):
+        return self.wait_time / self.busy_commands if self.busy_commands else 0.0
+
+    def __repr__(self):
+        return f'BusyWaitStats(commands={self.commands}, busy_commands={self.busy_commands}, ' \
+               f'busy_reads={self.busy_reads}, mean_wait_time={self.mean_wait_time:.6f}, ' \
+               f'max_wait_time={self.max_wait_time:.6f}, bus_time={self.bus_time:.6f})'
+
+
+class CommandBatch:
+    """Collects commands and sends them together, under a single acquisition of the bus
+
+    Use it via RevvyTransport.batch(). While the batch is open, commands sent from the same thread are queued and
+    return None. The responses are available in the order of sending after the batch is closed.
+
+    A batch opened inside another one on the same thread adds its commands to the outer batch when it closes, so they
+    are sent in order, in the same acquisition of the bus. The responses of the inner batch stay empty."""
+
+    _log = get_logger('CommandBatch')
+
+    def __init__(self, transport: 'RevvyTransport'):
+        self._transport = transport
+        self._commands = []
+        self._previous = None
+        self.responses = []
+
+    def send_command(self, command, payload=b'', frames: CommandFrames = None, receive_buffer=None):
+        if payload:
+            # the caller may reuse its payload buffer before the batch is executed
+            payload = bytes(payload)
+        self._commands.append((command, payload, frames, receive_buffer))
+
+    @property
+    def commands(self):
+        return self._commands
+
+    @property
+    def errors(self):
+        """List of (command id, Response) pairs for the commands that did not succeed"""
+        return [(command, response)
+                for (command, *_), response in zip(self._commands, self.responses)
+                if response.status != ResponseStatus.Ok]
+
+    def __enter__(self):
+        self._previous = self._transport._enter_batch(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._transport._enter_batch(self._previous)
+        if exc_type is None and self._commands:
+            if self._previous is not None:
+                self._previous._commands.extend(self._commands)
+                return
+
+            self.responses = self._transport.send_commands(self._commands)
+
+            for command, response in self.errors:
+                self._log(f'Command {command} failed with status "{response.status}"', LogLevel.WARNING)
+
+
 class RevvyTransport:
     _mutex = Lock()  # we only have a single I2C interface
     timeout = 5  # [seconds] how long the slave is allowed to respond with "busy"
 
-    def __init__(self, transport: RevvyTransportInterface):
+    def __init__(self, transport: RevvyTransportInterface, polling: BusyPolling = None,
+                 recorder: FlightRecorder = None):
+        """
+        @param recorder: If set, every command and its response is recorded into it
+        """
         self._transport = transport
+        self.recorder = recorder
         self._stopwatch = Stopwatch()
+        self.polling = polling or ExponentialBackoffPolling()
+        self._busy_stats = defaultdict(BusyWaitStats)
+        self._batch = local()
+        self._payload_length = {}  # last response length of each command, used to read header and payload at once
+
+        # commands with payload are built here, this is safe because the bus is locked while a command is executed
+        self._frame_buffer = bytearray(6 + 255)
+        self._frame_view = memoryview(self._frame_buffer)
 
-    def send_command(self, command, payload=b'') -> Response:
+    def batch(self) -> CommandBatch:
+        """
+        Create a command batch
+
+        Commands sent from the current thread inside a `with transport.batch() as batch:` block are queued and
+        executed when the block exits, without letting other threads access the bus in between.
+        """
+        return CommandBatch(self)
+
+    @property
+    def busy_stats(self):
+        """Busy-wait statistics of the sent commands, indexed by command id"""
+        return dict(self._busy_stats)
+
+    def reset_busy_stats(self):
+        self._busy_stats.clear()
+
+    def bus_time(self, command):
+        """Total time [seconds] the given command took on the bus since the statistics were last reset"""
+        stats = self._busy_stats.get(command)
+        return stats.bus_time if stats is not None else 0.0
+
+    def _enter_batch(self, batch):
+        previous, self._batch.current = getattr(self._batch, 'current', None), batch
+        return previous
+
+    def send_command(self, command, payload=b'', frames: CommandFrames = None,
+                     receive_buffer: bytearray = None) -> Optional[Response]:
         """
         Send a command and get the result.
 
         This function waits for commands to finish processing, so execution time depends on the MCU.
         The function detects integrity errors and retries incorrect writes and reads.
 
+        If a batch is open on the calling thread, the command is only queued and None is returned.
+
         @param command:
         @param payload:
+        @param frames: The prebuilt frames of the command, to avoid looking them up
+        @param receive_buffer: A bytearray of at least 5 + 255 bytes. If given, the response is read directly into it
+                               and the payload is returned as a memoryview of it instead of a copy, so it is only valid
+                               until the buffer is used again.
         @return:
         """
+        batch = getattr(self._batch, 'current', None)
+        if batch is not None:
+            batch.send_command(command, payload, frames, receive_buffer)
+            return None
+
+        with self._mutex:
+            return self._execute(command, payload, frames, receive_buffer)
+
+    def post(self, command, payload=b'', frames: CommandFrames = None,
+             receive_buffer: bytearray = None) -> Optional[Response]:
+        """
+        Send a command that the caller does not need to wait for
+
+        RevvyTransport has no thread of its own, so this is the same as send_command(). RevvyTransportWorker queues
+        the command and returns None instead.
+        """
+        return self.send_command(command, payload, frames, receive_buffer)
+
+    def send_commands(self, commands) -> List[Response]:
+        """
+        Send a list of (command, payload, frames, receive_buffer) tuples and return the list of their results
+
+        frames and receive_buffer may be None. The bus is not released between the commands. A command that fails
+        with an error status does not prevent sending the others, but an exception (e.g. a bus error) aborts the rest
+        and the responses of the commands already sent are lost.
+        """
         with self._mutex:
-            # create commands in advance, they can be reused in case of an error
-            command_start = Command.start(command, payload)
-            command_get_result = None
-
-            try:
-                # once a command gets through and a valid response is read, this loop will exit
-                while True:  # assume that integrity error is random and not caused by implementation differences
-                    # send command and read back status
-                    header = self._send_command(command_start)
-
-                    # wait for command execution to finish
-                    if header.status == ResponseStatus.Pending:
-                        # lazily create GetResult command
-                        if not command_get_result:
-                            command_get_result = Command.get_result(command)
-
-                        header = self._send_command(command_get_result)
-                        while header.status == ResponseStatus.Pending:
-                            header = self._send_command(command_get_result)
-
-                    # check result
-                    # return a result even in case of an error, except when we know we have to resend
-                    if header.status != ResponseStatus.Error_CommandIntegrityError:
-                        response_payload = self._read_payload(header)
-                        return Response(header.status, response_payload)
-            except TimeoutError:
-                return Response(ResponseStatus.Error_Timeout, b'')
-
-    def _read_response_header(self, retries=5) -> ResponseHeader:
+            return [self._execute(*command) for command in commands]
+
+    def _execute(self, command, payload, frames: CommandFrames = None, receive_buffer=None) -> Response:
+        recorder = self.recorder
+        stats = self._busy_stats[command]
+        start = time.monotonic()
+        try:
+            response = self._execute_command(command, payload, frames, receive_buffer)
+        except Exception:
+            duration = time.monotonic() - start
+            stats.bus_time += duration
+            if recorder is not None:
+                recorder.record(command, payload, STATUS_EXCEPTION, b'', start, duration)
+            raise
+
+        duration = time.monotonic() - start
+        stats.bus_time += duration
+        if recorder is not None:
+            recorder.record(command, payload, response.status.value, response.payload, start, duration)
+        return response
+
+    def _execute_command(self, command, payload, frames: CommandFrames = None, receive_buffer=None) -> Response:
+        if frames is None:
+            frames = CommandFrames.create(command)
+
+        # create commands in advance, they can be reused in case of an error
+        if payload:
+            frame_length = Command.write_into(self._frame_buffer, Command.OpStart, command, payload)
+            command_start = self._frame_view[0:frame_length]
+        else:
+            command_start = frames.start
+        command_get_result = frames.get_result
+        expected_length = self._payload_length.get(command, 0)
+
+        try:
+            # once a command gets through and a valid response is read, this loop will exit
+            while True:  # assume that integrity error is random and not caused by implementation differences
+                # send command and read back status
+                header, response_bytes = self._send_command(command_start, expected_length, receive_buffer)
+
+                # wait for command execution to finish
+                if header.status == ResponseStatus.Pending:
+                    header, response_bytes = self._send_command(command_get_result, expected_length, receive_buffer)
+                    while header.status == ResponseStatus.Pending:
+                        header, response_bytes = self._send_command(command_get_result, expected_length,
+                                                                    receive_buffer)
+
+                # check result
+                # return a result even in case of an error, except when we know we have to resend
+                if header.status != ResponseStatus.Error_CommandIntegrityError:
+                    self._payload_length[command] = header.payload_length
+                    response_payload = self._read_payload(header, response_bytes, receive_buffer)
+                    if receive_buffer is None:
+                        # the read buffers are reused by the interface, the caller gets a copy
+                        response_payload = bytes(response_payload)
+                    return Response(header.status, response_payload)
+        except TimeoutError:
+            return Response(ResponseStatus.Error_Timeout, b'')
+
+    def _read(self, length, receive_buffer=None):
+        if receive_buffer is None:
+            return self._transport.read(length)
+
+        read_length = self._transport.read_into(receive_buffer, length)
+        return memoryview(receive_buffer)[0:read_length]
+
+    def _read_response_header(self, retries=5, payload_length=0, receive_buffer=None):
         """
         Read header part of response message
 
-        Header is always 5 bytes long and it contains the length of the variable payload
+        Header is always 5 bytes long and it contains the length of the variable payload. If the expected payload
+        length is known, the payload is read together with the header, so that it does not need to be read again.
 
         @param retries: How many times the read can be retried in case an error happens
-        @return: The header data
+        @param payload_length: The number of payload bytes to read along with the header
+        @param receive_buffer: Optional buffer to read into
+        @return: The header data and the raw bytes that were read
         """
 
         def _read_response_header_once():
-            header_bytes = self._transport.read(5)
+            response_bytes = self._read(5 + payload_length, receive_buffer)
 
-            return ResponseHeader.create(header_bytes)
+            return ResponseHeader.create(response_bytes), response_bytes
 
         header = retry(_read_response_header_once, retries)
 
@@ -233,7 +473,7 @@ class RevvyTransport:
             raise BrokenPipeError('Read response header: Retry limit reached')
         return header
 
-    def _read_payload(self, header: ResponseHeader, retries=5) -> bytes:
+    def _read_payload(self, header: ResponseHeader, response_bytes=b'', receive_buffer=None, retries=5):
         """
         Read the rest of the response
 
@@ -241,19 +481,26 @@ class RevvyTransport:
         we receive the same header as before
 
         @param header: The expected header
+        @param response_bytes: Bytes already read together with the header, used if they contain the whole payload
+        @param receive_buffer: Optional buffer to read into
         @param retries: How many times the read can be retried in case an error happens
         @return: The payload bytes
         """
         if header.payload_length == 0:
             return b''
 
+        if len(response_bytes) == 5 + header.payload_length:
+            response_payload = response_bytes[5:]
+            if header.validate_payload(response_payload):
+                return response_payload
+
         def _read_payload_once():
             # read header and payload
-            response_bytes = self._transport.read(5 + header.payload_length)
-            response_header, response_payload = response_bytes[0:4], response_bytes[5:]  # skip checksum byte
+            response_bytes = self._read(5 + header.payload_length, receive_buffer)
+            response_payload = response_bytes[5:]  # skip checksum byte
 
             # make sure we read the same response data we expect
-            if not header.is_same_as(response_header):
+            if not header.is_same_as(response_bytes):
                 raise ValueError('Read payload: Unexpected header received')
 
             # make sure data is intact
@@ -269,20 +516,40 @@ class RevvyTransport:
 
         return payload
 
-    def _send_command(self, command: bytes) -> ResponseHeader:
+    def _send_command(self, command: bytes, payload_length=0, receive_buffer=None):
         """
         Send a command and return the response header
 
         This function waits for the slave MCU to finish processing the command and returns if it is done or the
-        timeout defined in the class header elapses.
+        timeout defined in the class header elapses. The time between two reads is decided by the polling strategy.
 
         @param command: The command bytes to send
-        @return: The response header
+        @param payload_length: The number of payload bytes to read along with the first header
+        @param receive_buffer: Optional buffer to read into
+        @return: The response header and the raw bytes that were read
         """
+        stats = self._busy_stats[command[1]]
+        stats.commands += 1
+
         self._transport.write(command)
         self._stopwatch.reset()
-        while self._stopwatch.elapsed < self.timeout:
-            response = self._read_response_header()
-            if response.status != ResponseStatus.Busy:
-                return response
-        raise TimeoutError
+        busy_reads = 0
+        try:
+            while self._stopwatch.elapsed < self.timeout:
+                response, response_bytes = self._read_response_header(payload_length=payload_length,
+                                                                      receive_buffer=receive_buffer)
+                if response.status != ResponseStatus.Busy:
+                    return response, response_bytes
+
+                # a busy response has no payload, keep polling with header-only reads
+                payload_length = 0
+                self.polling.wait(busy_reads)
+                busy_reads += 1
+            raise TimeoutError
+        finally:
+            if busy_reads:
+                wait_time = self._stopwatch.elapsed
+                stats.busy_commands += 1
+                stats.busy_reads += busy_reads
+                stats.wait_time += wait_time
+                stats.max_wait_time = max(stats.max_wait_time, wait_time)
@@ -0,0 +1,181 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import itertools
+from concurrent.futures import Future
+from enum import IntEnum
+from queue import PriorityQueue
+from threading import Thread, Lock, local, get_ident
+from typing import Optional, List
+
+from revvy.mcu.rrrc_transport import RevvyTransport, CommandBatch, CommandFrames, Response, ResponseStatus
+from revvy.utils.logger import get_logger, LogLevel
+
+
+class Priority(IntEnum):
+    """Lower value is executed first"""
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class RevvyTransportWorker:
+    """Owns the MCU bus: commands are queued and executed on a dedicated thread, in priority order
+
+    The worker can be used in place of the RevvyTransport it wraps. send_command() and send_commands() wait for
+    the result, as before. submit() returns a Future, post() does not wait at all (fire-and-forget), failures of
+    posted commands are logged.
+
+    Commands that are already being executed are not interrupted, but queued motor setpoints are executed before
+    queued status reads, which are executed before LED frames and error memory access. To avoid starving the low
+    priority commands, a command can only be overtaken by `aging` later commands per priority level.
+    """
+
+    priorities = {
+        0x14: Priority.HIGH,  # motor control
+        0x31: Priority.LOW,  # ring LED scenario
+        0x33: Priority.LOW,  # ring LED user frame
+        0x3D: Priority.LOW,  # error memory
+        0x3E: Priority.LOW,
+        0x3F: Priority.LOW,
+        0x40: Priority.LOW,
+    }
+    aging = 8
+
+    def __init__(self, transport: RevvyTransport, name='McuBus'):
+        self._transport = transport
+        self._queue = PriorityQueue()
+        self._sequence = itertools.count()  # keeps the order of commands with the same priority
+        self._batch = local()
+        self._log = get_logger(f'RevvyTransportWorker [{name}]')
+        self._exiting = False
+        self._exit_lock = Lock()
+
+        # daemon thread, so that a forgotten worker does not keep the process alive
+        self._thread = Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def transport(self) -> RevvyTransport:
+        return self._transport
+
+    @property
+    def busy_stats(self):
+        return self._transport.busy_stats
+
+    def reset_busy_stats(self):
+        self._transport.reset_busy_stats()
+
+    def bus_time(self, command):
+        return self._transport.bus_time(command)
+
+    def batch(self) -> CommandBatch:
+        """
+        Create a command batch
+
+        Commands sent from the current thread inside a `with worker.batch():` block are queued and executed as a
+        single work item when the block exits.
+        """
+        return CommandBatch(self)
+
+    def _enter_batch(self, batch):
+        previous, self._batch.current = getattr(self._batch, 'current', None), batch
+        return previous
+
+    def _run(self):
+        while True:
+            _, _, future, work = self._queue.get()
+            if work is None:
+                break
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(work())
+                except Exception as e:
+                    future.set_exception(e)
+
+    def _enqueue(self, priority, work) -> Future:
+        future = Future()
+        with self._exit_lock:
+            if self._exiting:
+                raise BrokenPipeError('Transport worker exited')
+            sequence = next(self._sequence)
+            self._queue.put((sequence + priority * self.aging, sequence, future, work))
+        return future
+
+    def _priority_of(self, command):
+        return self.priorities.get(command, Priority.NORMAL)
+
+    def submit(self, command, payload=b'', frames: CommandFrames = None, receive_buffer: bytearray = None,
+               priority: Priority = None) -> Future:
+        """
+        Queue a command, return a Future of its Response
+
+        @param priority: Overrides the default priority of the command
+        """
+        if priority is None:
+            priority = self._priority_of(command)
+        if payload:
+            # the caller may reuse its payload buffer before the command is executed
+            payload = bytes(payload)
+
+        execute = self._transport.send_command
+        return self._enqueue(priority, lambda: execute(command, payload, frames, receive_buffer))
+
+    def _in_worker_thread(self):
+        return get_ident() == self._thread.ident
+
+    def send_command(self, command, payload=b'', frames: CommandFrames = None,
+                     receive_buffer: bytearray = None) -> Optional[Response]:
+        """Send a command and wait for the result, see RevvyTransport.send_command()"""
+        batch = getattr(self._batch, 'current', None)
+        if batch is not None:
+            batch.send_command(command, payload, frames, receive_buffer)
+            return None
+
+        if self._in_worker_thread():
+            # called from a done callback, waiting for the queue would deadlock
+            return self._transport.send_command(command, payload, frames, receive_buffer)
+
+        return self.submit(command, payload, frames, receive_buffer).result()
+
+    def send_commands(self, commands) -> List[Response]:
+        """Send a list of commands as a single work item and wait for the results, see RevvyTransport.send_commands()"""
+        if self._in_worker_thread():
+            return self._transport.send_commands(commands)
+
+        priority = min(self._priority_of(command) for command, *_ in commands)
+        return self._enqueue(priority, lambda: self._transport.send_commands(commands)).result()
+
+    def post(self, command, payload=b'', frames: CommandFrames = None, receive_buffer: bytearray = None) -> None:
+        """
+        Queue a command without waiting for the result
+
+        Inside a batch, the command is added to the batch instead.
+        """
+        batch = getattr(self._batch, 'current', None)
+        if batch is not None:
+            batch.send_command(command, payload, frames, receive_buffer)
+            return None
+
+        future = self.submit(command, payload, frames, receive_buffer)
+        future.add_done_callback(lambda f: self._report(command, f))
+        return None
+
+    def _report(self, command, future: Future):
+        try:
+            response = future.result()
+        except Exception as e:
+            self._log(f'Posted command {command} failed: {e!r}', LogLevel.ERROR)
+        else:
+            if response.status != ResponseStatus.Ok:
+                self._log(f'Posted command {command} failed with status "{response.status}"', LogLevel.WARNING)
+
+    def exit(self):
+        """Execute the already queued commands, then stop the worker thread"""
+        with self._exit_lock:
+            if self._exiting:
+                return
+            self._exiting = True
+            # sorts after every queued command
+            self._queue.put((float('inf'), next(self._sequence), None, None))
+        self._thread.join()
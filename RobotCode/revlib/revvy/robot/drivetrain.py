@@ -1,5 +1,4 @@
 # SPDX-License-Identifier: GPL-3.0-only
-import itertools
 from contextlib import suppress
 from threading import Timer
 
@@ -7,6 +6,7 @@ from revvy.mcu.rrrc_control import RevvyControl
 from revvy.robot.imu import IMU
 from revvy.robot.ports.common import PortInstance
 from revvy.robot.ports.motors.dc_motor import MotorStatus, MotorConstants
+from revvy.robot.ports.motors.setpoints import MotorSetpointCache
 from revvy.utils.awaiter import AwaiterImpl, Awaiter
 from revvy.utils.functions import clip
 from revvy.utils.logger import get_logger
@@ -94,6 +94,7 @@ class DifferentialDrivetrain:
 
     def __init__(self, interface: RevvyControl, imu: IMU):
         self._interface = interface
+        self._setpoints = MotorSetpointCache.of(interface)
         self._motors = []
         self._left_motors = []
         self._right_motors = []
@@ -169,26 +170,32 @@ class DifferentialDrivetrain:
             if controller:
                 controller.update()
 
+    def _apply(self, left_commands, right_commands, force=False):
+        # all motors are updated in a single command, through the cache so it knows their last setpoints
+        with self._setpoints.merge():
+            for motor, command in zip(self._left_motors, left_commands):
+                self._setpoints.request(motor.id - 1, command, force)
+            for motor, command in zip(self._right_motors, right_commands):
+                self._setpoints.request(motor.id - 1, command, force)
+
     def _apply_release(self):
-        commands = itertools.chain(
-            *(motor.create_set_power_command(0) for motor in self._left_motors),
-            *(motor.create_set_power_command(0) for motor in self._right_motors)
+        self._apply(
+            (motor.create_set_power_command(0) for motor in self._left_motors),
+            (motor.create_set_power_command(0) for motor in self._right_motors)
         )
-        self._interface.set_motor_port_control_value(bytes(commands))
 
     def _apply_speeds(self, left, right, power_limit):
-        commands = itertools.chain(
-            *(motor.create_set_speed_command(left, power_limit) for motor in self._left_motors),
-            *(motor.create_set_speed_command(right, power_limit) for motor in self._right_motors)
+        self._apply(
+            (motor.create_set_speed_command(left, power_limit) for motor in self._left_motors),
+            (motor.create_set_speed_command(right, power_limit) for motor in self._right_motors)
         )
-        self._interface.set_motor_port_control_value(bytes(commands))
 
     def _apply_positions(self, left, right, left_speed, right_speed, power_limit):
-        commands = itertools.chain(
-            *(motor.create_relative_position_command(left, left_speed, power_limit) for motor in self._left_motors),
-            *(motor.create_relative_position_command(right, right_speed, power_limit) for motor in self._right_motors)
+        self._apply(
+            (motor.create_relative_position_command(left, left_speed, power_limit) for motor in self._left_motors),
+            (motor.create_relative_position_command(right, right_speed, power_limit) for motor in self._right_motors),
+            force=True
         )
-        self._interface.set_motor_port_control_value(bytes(commands))
 
     def _process_unit_speed(self, speed, unit_speed):
         if unit_speed == MotorConstants.UNIT_SPEED_RPM:
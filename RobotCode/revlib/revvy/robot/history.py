@@ -0,0 +1,130 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import math
+import statistics
+from array import array
+from bisect import bisect_left
+
+
+class SignalHistory:
+    """Fixed-length circular history of a signal, with the time of every sample
+
+    Values and timestamps are kept in two preallocated arrays of doubles. Queries work on the samples in
+    chronological order, the statistics are done by the builtins over array slices, without per-sample Python code.
+
+    >>> history = SignalHistory(4)
+    >>> for t, value in enumerate([10, 12, 11, 13, 40]):
+    ...     history.append(value, t)
+    >>> list(history.last())
+    [12.0, 11.0, 13.0, 40.0]
+    >>> history.median(3), history.max(1.5), history.velocity(2)
+    (13.0, 40.0, 27.0)
+    """
+
+    __slots__ = ('_values', '_times', '_length', '_next', '_count')
+
+    def __init__(self, length=64):
+        if length < 1:
+            raise ValueError('History length must be at least 1')
+        self._values = array('d', bytes(8 * length))
+        self._times = array('d', bytes(8 * length))
+        self._length = length
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        return self._length
+
+    @property
+    def latest(self):
+        """The last value, None if there is no sample yet"""
+        return self._values[self._next - 1] if self._count else None
+
+    @property
+    def last_time(self):
+        """Timestamp of the last sample, None if there is no sample yet"""
+        return self._times[self._next - 1] if self._count else None
+
+    def append(self, value, timestamp):
+        idx = self._next
+        self._values[idx] = value
+        self._times[idx] = timestamp
+        self._next = (idx + 1) % self._length
+        if self._count < self._length:
+            self._count += 1
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def _ordered(self, buffer: array, n):
+        # the last n entries of a ring buffer, oldest first
+        end = self._next
+        start = end - n
+        if start >= 0:
+            return buffer[start:end]
+        return buffer[start + self._length:self._length] + buffer[0:end]
+
+    def last(self, n=None) -> array:
+        """The last n values (all of them if n is None), oldest first"""
+        n = self._count if n is None else min(n, self._count)
+        return self._ordered(self._values, n)
+
+    def times(self, n=None) -> array:
+        """Timestamps of the last n samples, oldest first"""
+        n = self._count if n is None else min(n, self._count)
+        return self._ordered(self._times, n)
+
+    def window(self, seconds, now=None) -> array:
+        """
+        Values sampled in the last `seconds`
+
+        @param now: end of the window, the time of the last sample by default
+        """
+        if not self._count:
+            return self._values[0:0]
+        if now is None:
+            now = self.last_time
+
+        times = self.times()
+        return self.last()[bisect_left(times, now - seconds):]
+
+    def mean(self, seconds, now=None):
+        """Mean of the values of the window, NaN if it is empty"""
+        values = self.window(seconds, now)
+        return math.fsum(values) / len(values) if values else math.nan
+
+    def min(self, seconds, now=None):
+        values = self.window(seconds, now)
+        return min(values) if values else math.nan
+
+    def max(self, seconds, now=None):
+        values = self.window(seconds, now)
+        return max(values) if values else math.nan
+
+    def median(self, n=5):
+        """Median of the last n values, to filter out single-sample noise. NaN if there is no sample"""
+        values = self.last(n)
+        return statistics.median(values) if values else math.nan
+
+    def velocity(self, n=2):
+        """
+        Rate of change over the last n samples [unit / second]
+
+        Finite difference of the oldest and newest of them, a larger n is less noisy but lags more. 0 if there are
+        not enough samples.
+        """
+        n = min(n, self._count)
+        if n < 2:
+            return 0.0
+
+        last = self._next - 1
+        first = last - n + 1  # negative indices wrap around the ring
+        dt = self._times[last] - self._times[first]
+        if dt <= 0:
+            return 0.0
+        return (self._values[last] - self._values[first]) / dt
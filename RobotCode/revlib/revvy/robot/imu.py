@@ -4,45 +4,63 @@ import collections
 import struct
 
 from revvy.robot.ports.common import FunctionAggregator
+from revvy.robot.telemetry import TelemetryStore
 
 Vector3D = collections.namedtuple('Vector3D', ['x', 'y', 'z'])
 
 
 class IMU:
-    def __init__(self):
-        self._acceleration = Vector3D(0, 0, 0)
-        self._rotation = Vector3D(0, 0, 0)
-        self._yaw_angle = 0
-        self._relative_yaw_angle = 0
+    """Keeps the IMU values in a TelemetryStore, Vector3D objects are only created when they are read"""
+
+    # layouts of the status updater slots
+    vector_struct = struct.Struct('<hhh')
+    yaw_struct = struct.Struct('<ll')
+
+    axl_lsb = 0.061
+    gyro_lsb = 0.035*1.03
+
+    def __init__(self, store: TelemetryStore = None):
+        self._store = store or TelemetryStore()
+        self._data = self._store.data
 
         self._change_callbacks = FunctionAggregator()
 
     @property
     def yaw_angle(self):
-        return self._yaw_angle
+        return self._store.yaw.yaw_angle
 
     @property
     def relative_yaw_angle(self):
-        return self._relative_yaw_angle  # TODO pinning is not yet implemented
+        return self._store.yaw.relative_yaw_angle  # TODO pinning is not yet implemented
 
     @property
     def acceleration(self):
-        return self._acceleration
+        offset = TelemetryStore.ACCELERATION
+        return Vector3D(*self._data[offset:offset + 3])
 
     @property
     def rotation(self):
-        return self._rotation
-
-    @staticmethod
-    def _read_vector(data, lsb_value):
-        (x, y, z) = struct.unpack('<hhh', data)
-        return Vector3D(x * lsb_value, y * lsb_value, z * lsb_value)
+        offset = TelemetryStore.ROTATION
+        return Vector3D(*self._data[offset:offset + 3])
 
     def update_yaw_angles(self, data):
-        (self._yaw_angle, self._relative_yaw_angle) = struct.unpack('<ll', data)
+        self.update_yaw_values(*self.yaw_struct.unpack(data))
 
     def update_axl_data(self, data):
-        self._acceleration = self._read_vector(data, 0.061)
+        self.update_axl_values(*self.vector_struct.unpack(data))
 
     def update_gyro_data(self, data):
-        self._rotation = self._read_vector(data, 0.035*1.03)
+        self.update_gyro_values(*self.vector_struct.unpack(data))
+
+    # handlers for the values unpacked by the status updater
+
+    def update_yaw_values(self, yaw_angle, relative_yaw_angle):
+        self._store.set_yaw(yaw_angle, relative_yaw_angle)
+
+    def update_axl_values(self, x, y, z):
+        lsb = self.axl_lsb
+        self._store.set_vector(TelemetryStore.ACCELERATION, x * lsb, y * lsb, z * lsb)
+
+    def update_gyro_values(self, x, y, z):
+        lsb = self.gyro_lsb
+        self._store.set_vector(TelemetryStore.ROTATION, x * lsb, y * lsb, z * lsb)
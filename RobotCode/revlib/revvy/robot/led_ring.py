@@ -1,9 +1,23 @@
 # SPDX-License-Identifier: GPL-3.0-only
 
+import struct
+import time
+from threading import Lock
+
+from revvy.mcu.commands import rgb_to_rgb565_bytes
 from revvy.mcu.rrrc_control import RevvyControl
 
 
 class RingLed:
+    """Controls the LED ring, without sending commands that would not change what it displays
+
+    The last scenario and user frame sent to the MCU are remembered, setting them again is a no-op. Call
+    invalidate() if the MCU may have lost its state (e.g. after a reset) to make the next commands go through.
+
+    Frames are converted to the RGB565 payload once per distinct frame. Animations should use request_frame(): it
+    sends at most max_frame_rate frames per second, the frame that is requested last is sent by flush() when its turn
+    comes."""
+
     Off = 0
     UserFrame = 1
     ColorWheel = 2
@@ -13,10 +27,21 @@ class RingLed:
     Siren = 6
     TrafficLight = 7
 
-    def __init__(self, interface: RevvyControl):
+    frame_cache_size = 32
+
+    def __init__(self, interface: RevvyControl, max_frame_rate=25):
         self._interface = interface
         self._ring_led_count = self._interface.ring_led_get_led_amount()
         self._current_scenario = self.BreathingGreen
+        self._lock = Lock()
+
+        self._sent_scenario = None  # None: unknown
+        self._sent_frame = None
+        self._frame_bytes = {}  # tuple of colors -> RGB565 payload
+
+        self._min_frame_interval = 1 / max_frame_rate
+        self._pending_frame = None
+        self._next_frame_time = 0.0
 
     @property
     def count(self):
@@ -26,13 +51,80 @@ class RingLed:
     def scenario(self):
         return self._current_scenario
 
+    @property
+    def max_frame_rate(self):
+        return 1 / self._min_frame_interval
+
+    @max_frame_rate.setter
+    def max_frame_rate(self, rate):
+        self._min_frame_interval = 1 / rate
+
+    def invalidate(self):
+        """Forget what was sent, the next scenario and frame are sent unconditionally"""
+        with self._lock:
+            self._sent_scenario = None
+            self._sent_frame = None
+
     def start_animation(self, scenario):
-        self._current_scenario = scenario
-        self._interface.ring_led_set_scenario(scenario)
+        with self._lock:
+            self._current_scenario = scenario
+            if scenario != self._sent_scenario:
+                self._interface.ring_led_set_scenario(scenario)
+                self._sent_scenario = scenario
+
+    def _to_bytes(self, frame):
+        if isinstance(frame, (bytes, bytearray)):
+            return bytes(frame)
+
+        key = tuple(frame)
+        try:
+            return self._frame_bytes[key]
+        except KeyError:
+            if len(self._frame_bytes) >= self.frame_cache_size:
+                self._frame_bytes.clear()
+            frame_bytes = struct.pack(f'<{len(key)}H', *map(rgb_to_rgb565_bytes, key))
+            self._frame_bytes[key] = frame_bytes
+            return frame_bytes
 
     def upload_user_frame(self, frame):
-        self._interface.ring_led_set_user_frame(frame)
+        """
+        @param frame: list of 24 bit RGB colors, one for each LED, or an already converted RGB565 payload
+        """
+        frame_bytes = self._to_bytes(frame)
+        with self._lock:
+            if frame_bytes != self._sent_frame:
+                self._interface.ring_led_set_user_frame(frame_bytes)
+                self._sent_frame = frame_bytes
 
     def display_user_frame(self, frame):
-        self.upload_user_frame(frame)
-        self.start_animation(self.UserFrame)
+        frame_bytes = self._to_bytes(frame)
+        with self._lock:
+            if frame_bytes == self._sent_frame and self._sent_scenario == self.UserFrame:
+                self._current_scenario = self.UserFrame
+                return
+
+        with self._interface.batch():
+            self.upload_user_frame(frame_bytes)
+            self.start_animation(self.UserFrame)
+
+    def request_frame(self, frame):
+        """
+        Display a frame of an animation, rate limited to max_frame_rate
+
+        The frame is displayed now if enough time has passed since the previous one, otherwise it replaces the frame
+        waiting for flush().
+        """
+        with self._lock:
+            self._pending_frame = frame
+        self.flush()
+
+    def flush(self):
+        """Display the requested frame if it is due, call it periodically while animating"""
+        now = time.monotonic()
+        with self._lock:
+            frame = self._pending_frame
+            if frame is None or now < self._next_frame_time:
+                return
+            self._pending_frame = None
+            self._next_frame_time = now + self._min_frame_interval
+        self.display_user_frame(frame)
@@ -108,8 +108,37 @@ class PortHandler:
         return driver
 
 
+def _forward_property(prop: property):
+    getter = prop.fget
+    return property(lambda port: getter(port._driver), doc=prop.__doc__)
+
+
+def _driver_members(driver_type):
+    """Public methods and properties of a driver class, excluding the ones PortInstance defines itself"""
+    methods = []
+    properties = {}
+    for name in dir(driver_type):
+        if name.startswith('_') or hasattr(PortInstance, name):
+            continue
+        member = getattr(driver_type, name)
+        if isinstance(member, property):
+            if member.fget is not None:
+                properties[name] = _forward_property(member)
+        elif callable(member) and not isinstance(member, type):
+            methods.append(name)
+    return tuple(methods), properties
+
+
 class PortInstance:
-    props = ['log', '_port_idx', '_configurator', '_interface', '_driver', '_config_changed_callbacks']
+    """A port of the robot, delegates to the driver it is configured with
+
+    Configuring a port binds the public methods of the driver to the port instance and switches the class of the
+    port to one that forwards the properties of the driver, so these are not looked up via __getattr__ on every
+    access. Other attributes of the driver are still reached through __getattr__."""
+    props = frozenset(['log', '_port_idx', '_configurator', '_interface', '_driver', '_config_changed_callbacks'])
+    __slots__ = (*props, '__dict__')
+
+    _proxy_types = {}  # driver class -> (PortInstance subclass, public method names)
 
     def __init__(self, port_idx, name, interface: RevvyControl, configurator):
         self.log = get_logger(f'{name} {port_idx}')
@@ -131,12 +160,37 @@ class PortInstance:
     def on_config_changed(self):
         return self._config_changed_callbacks
 
+    @classmethod
+    def _proxy_type(cls, driver_type):
+        try:
+            return cls._proxy_types[driver_type]
+        except KeyError:
+            methods, properties = _driver_members(driver_type)
+            proxy_type = type(f'PortInstance[{driver_type.__name__}]', (PortInstance, ), {
+                '__slots__': (),
+                **properties
+            })
+            return cls._proxy_types.setdefault(driver_type, (proxy_type, methods))
+
+    def _bind_driver(self, driver):
+        bound = self.__dict__
+        bound.clear()
+        if driver is None:
+            object.__setattr__(self, '__class__', PortInstance)
+        else:
+            proxy_type, methods = self._proxy_type(type(driver))
+            object.__setattr__(self, '__class__', proxy_type)
+            for name in methods:
+                bound[name] = getattr(driver, name)
+
     def _configure(self, config):
         # temporarily disable reading port
         self._config_changed_callbacks(self, None)
         if self._driver:
             self._driver.uninitialize()
+        self._bind_driver(None)
         self._driver = self._configurator(self, config)
+        self._bind_driver(self._driver)
         self._config_changed_callbacks(self, config)
 
         return self._driver
@@ -154,6 +208,6 @@ class PortInstance:
 
     def __setattr__(self, key, value):
         if key in self.props:
-            self.__dict__[key] = value
+            object.__setattr__(self, key, value)
         else:
             setattr(self._driver, key, value)
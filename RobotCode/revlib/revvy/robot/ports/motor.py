@@ -69,5 +69,8 @@ class NullMotor(PortDriver):
     def update_status(self, data):
         pass
 
+    def update_status_values(self, *values):
+        pass
+
     def stop(self, _=MotorConstants.ACTION_RELEASE):
         pass
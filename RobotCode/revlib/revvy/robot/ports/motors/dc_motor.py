@@ -4,8 +4,10 @@ from functools import partial
 
 from revvy.robot.ports.common import PortInstance, PortDriver
 from revvy.robot.ports.motor import MotorConstants
+from revvy.robot.ports.motors.setpoints import MotorSetpointCache
 from revvy.utils.awaiter import AwaiterImpl, Awaiter
 from revvy.utils.functions import clip
+from revvy.utils.logger import LogLevel
 
 
 def motor_port_control_command(port_idx, *command_data):
@@ -55,12 +57,18 @@ class MotorStatus(Enum):
 
 class DcMotorController(PortDriver):
     """Generic driver for dc motors"""
+
+    # layout of the status updater slot: status, power, position, speed
+    status_struct = struct.Struct('<bblf')
+
     def __init__(self, port: PortInstance, port_config):
         super().__init__(port, 'DcMotor')
         self._port = port
         self._port_config = port_config
 
         self._configure = partial(port.interface.set_motor_port_config, port.id)
+        self._setpoints = MotorSetpointCache.of(port.interface)
+        self._request = partial(self._setpoints.request, self._port.id - 1)
 
         self._pos = 0
         self._speed = 0
@@ -98,13 +106,20 @@ class DcMotorController(PortDriver):
         self.log(f'Sending configuration: {config}')
 
         self._configure(config)
+        # the motor is reset by the configuration, the last setpoint is no longer valid
+        self._setpoints.invalidate(self._port.id - 1)
 
     def _cancel_awaiter(self):
         awaiter, self._awaiter = self._awaiter, None
         if awaiter:
-            self.log('Cancelling previous request')
+            self.log('Cancelling previous request', LogLevel.DEBUG)
             awaiter.cancel()
 
+    @property
+    def setpoints(self) -> MotorSetpointCache:
+        """The cache that the control requests of this motor go through, use its merge() to control motors together"""
+        return self._setpoints
+
     @property
     def speed(self):
         return self._speed
@@ -124,15 +139,15 @@ class DcMotorController(PortDriver):
 
     def set_power(self, power):
         self._cancel_awaiter()
-        self.log('set_power')
+        self.log('set_power: %s', LogLevel.DEBUG, power)
 
-        self._port.interface.set_motor_port_control_value(self.create_set_power_command(power))
+        self._request(self.create_set_power_command(power))
 
     def set_speed(self, speed, power_limit=None):
         self._cancel_awaiter()
-        self.log('set_speed')
+        self.log('set_speed: %s', LogLevel.DEBUG, speed)
 
-        self._port.interface.set_motor_port_control_value(self.create_set_speed_command(speed, power_limit))
+        self._request(self.create_set_speed_command(speed, power_limit))
 
     def set_position(self, position: int, speed_limit=None, power_limit=None, pos_type='absolute') -> Awaiter:
         """
@@ -142,7 +157,7 @@ class DcMotorController(PortDriver):
         @param pos_type: 'absolute': turn to this angle, counted from startup; 'relative': turn this many degrees
         """
         self._cancel_awaiter()
-        self.log('set_position')
+        self.log('set_position: %s (%s)', LogLevel.DEBUG, position, pos_type)
 
         def _finished():
             self._awaiter = None
@@ -164,7 +179,8 @@ class DcMotorController(PortDriver):
         else:
             raise ValueError(f'Invalid pos_type {pos_type}')
 
-        self._port.interface.set_motor_port_control_value(command)
+        # a repeated position request starts a new movement, it must not be skipped
+        self._request(command, force=True)
 
         return awaiter
 
@@ -184,16 +200,22 @@ class DcMotorController(PortDriver):
                 awaiter.cancel()
 
     def update_status(self, data):
-        if len(data) == 10:
-            status, self._power, self._pos, self._speed = struct.unpack('<bblf', data)
-
-            self._update_motor_status(MotorStatus(status))
-            self.on_status_changed(self._port)
+        if len(data) == self.status_struct.size:
+            self.update_status_values(*self.status_struct.unpack(data))
         else:
-            self.log(f'Received {len(data)} bytes of data instead of 10')
+            self.log(f'Received {len(data)} bytes of data instead of {self.status_struct.size}')
+
+    def update_status_values(self, status, power, pos, speed):
+        """Status updater handler for the values unpacked with status_struct"""
+        self._power = power
+        self._pos = pos
+        self._speed = speed
+
+        self._update_motor_status(MotorStatus(status))
+        self.on_status_changed(self._port)
 
     def stop(self, action=MotorConstants.ACTION_RELEASE):
-        self.log("stop")
+        self.log('stop', LogLevel.DEBUG)
         if action == MotorConstants.ACTION_STOP_AND_HOLD:
             self.set_speed(0)
         else:
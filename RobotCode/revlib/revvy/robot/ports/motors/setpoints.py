@@ -0,0 +1,114 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import time
+from contextlib import contextmanager
+from threading import Lock, local
+from weakref import WeakKeyDictionary
+
+from revvy.mcu.rrrc_control import RevvyControl
+
+
+class _MergeState(local):
+    """The merge depth and the collected requests of the current thread"""
+    def __init__(self):
+        self.depth = 0
+        self.pending = {}  # port index -> (request bytes, force)
+
+
+class MotorSetpointCache:
+    """Sends motor control requests, skipping the ones that would not change anything
+
+    Every port remembers the last request that was sent to it. A request that is identical to it is only sent again
+    once it is older than `keep_alive` seconds (None: never, 0: always). Requests made inside a `merge()` block are
+    collected and sent as a single multi-port control command when the outermost block exits. Merging is per thread,
+    like CommandBatch: a merge on one thread does not hold back the requests of the others.
+
+    There is one cache per MCU, use MotorSetpointCache.of(interface) to get it.
+    """
+
+    _instances = WeakKeyDictionary()
+
+    @classmethod
+    def of(cls, interface: RevvyControl) -> 'MotorSetpointCache':
+        try:
+            return cls._instances[interface]
+        except KeyError:
+            return cls._instances.setdefault(interface, cls(interface))
+
+    def __init__(self, interface: RevvyControl, keep_alive=0.5):
+        self._send = interface.set_motor_port_control_value
+        self.keep_alive = keep_alive
+        self._lock = Lock()
+        self._last = {}  # port index -> (request bytes, time of sending)
+        self._merge_state = _MergeState()
+
+        # merged requests are written here, the command copies the payload if it does not send it right away
+        self._frame_view = memoryview(bytearray(255))
+
+    def request(self, port_idx, request, force=False):
+        """
+        Send a control request to a motor port
+
+        @param port_idx: 0-based port index, as encoded in the request header
+        @param request: A motor_port_control_command() tuple or bytes
+        @param force: Send even if the same request was sent last, for requests that are not idempotent (e.g.
+                      relative positioning)
+        """
+        if type(request) is not bytes:
+            request = bytes(request)
+        state = self._merge_state
+        state.pending[port_idx] = (request, force)
+        if not state.depth:
+            self.flush()
+
+    @contextmanager
+    def merge(self):
+        """Collect the requests of the block and send them in a single command"""
+        state = self._merge_state
+        state.depth += 1
+        try:
+            yield self
+        finally:
+            state.depth -= 1
+            if not state.depth:
+                self.flush()
+
+    def flush(self):
+        """Send the pending requests of the current thread that are different from the last ones sent"""
+        pending = self._merge_state.pending
+        if not pending:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            keep_alive = self.keep_alive
+            frame = self._frame_view
+            length = 0
+            sent = []
+            for port_idx, (request, force) in pending.items():
+                if not force:
+                    last = self._last.get(port_idx)
+                    if last is not None and last[0] == request \
+                            and (keep_alive is None or now - last[1] < keep_alive):
+                        continue
+
+                end = length + len(request)
+                frame[length:end] = request
+                length = end
+                sent.append((port_idx, request))
+            pending.clear()
+
+            if length:
+                self._send(frame[0:length])
+
+                # only remember what was actually sent, a failing command raises before this point
+                for port_idx, request in sent:
+                    self._last[port_idx] = (request, now)
+
+    def invalidate(self, port_idx=None):
+        """Forget the last request of a port (or all ports), so that the next one is sent unconditionally"""
+        with self._lock:
+            if port_idx is None:
+                self._last.clear()
+            else:
+                self._last.pop(port_idx, None)
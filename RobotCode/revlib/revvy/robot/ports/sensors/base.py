@@ -29,10 +29,46 @@ class BaseSensorPortDriver(PortDriver):
         self._interface = port.interface
         self._value = None
         self._raw_value = None
+        self._triggers = []
+        self._trigger_sample_time = None
 
     def on_port_type_set(self):
         pass
 
+    def add_trigger(self, trigger):
+        """
+        Evaluate a trigger (see revvy.robot.ports.sensors.triggers) on every sample of the sensor
+
+        @return: the trigger, to be used with remove_trigger()
+        """
+        self._triggers.append(trigger)
+        return trigger
+
+    def remove_trigger(self, trigger):
+        if trigger in self._triggers:
+            self._triggers.remove(trigger)
+
+    @property
+    def has_triggers(self):
+        return bool(self._triggers)
+
+    def sample_triggers(self, timestamp):
+        """
+        Evaluate the triggers on the current value if the sample is new
+
+        Called by the owner of the status updater after each read, with the sample time of the sensor slot. The status
+        updater only calls update_status() when the data changes, but debouncing counts every sample.
+        """
+        if timestamp is None or timestamp == self._trigger_sample_time:
+            return
+        self._trigger_sample_time = timestamp
+
+        value = self._value
+        if value is None:
+            return
+        for trigger in self._triggers:
+            trigger.handle(value)
+
     @property
     def has_data(self):
         return self._value is not None
@@ -45,6 +81,8 @@ class BaseSensorPortDriver(PortDriver):
         if self._raw_value == data:
             return
 
+        # data may be a view of a reused buffer, keep a copy
+        data = bytes(data)
         self._raw_value = data
         converted = self.convert_sensor_value(data)
 
@@ -1,11 +1,16 @@
+import os
 import struct
 from functools import partial
+from threading import Lock, Thread
 
 from typing import NamedTuple
 
+from revvy.mcu.rrrc_transport import ResponseStatus
 from revvy.robot.ports.common import PortInstance
 from revvy.robot.ports.sensors.base import BaseSensorPortDriver
-from revvy.utils.functions import split, map_values
+from revvy.utils.file_storage import StorageInterface, FileStorage, MemoryStorage, StorageError
+from revvy.utils.functions import map_values
+from revvy.utils.logger import get_logger, LogLevel
 
 
 class Ev3DataType(NamedTuple):
@@ -15,12 +20,14 @@ class Ev3DataType(NamedTuple):
 
 
 class Ev3Mode:
+    info_struct = struct.Struct('<4b6f')  # layout of a mode info page
+
     @staticmethod
     def parse(mode_info):
         (nSamples, dataType, figures, decimals,
          raw_min, raw_max,
          pct_min, pct_max,
-         si_min, si_max) = struct.unpack('<4b6f', mode_info)
+         si_min, si_max) = Ev3Mode.info_struct.unpack(mode_info)
 
         return Ev3Mode(nSamples, dataType, figures, decimals, raw_min, raw_max, pct_min, pct_max, si_min,
                        si_max)
@@ -48,19 +55,39 @@ class Ev3Mode:
         self._si_min = si_min
         self._si_max = si_max
 
+        type_info = self._type_info[data_type]
+        self._data_size = type_info.data_size
+        self._byte_order = type_info.read_pattern[0] if type_info.read_pattern[0] in '<>' else '<'
+        self._format_char = type_info.read_pattern[-1]
+        self._structs = {}  # number of values -> struct.Struct that unpacks all of them at once
+        self._struct_for(n_samples)
+
+        if raw_max != raw_min:
+            # map_values() with its constant part precomputed
+            self._scale = (si_max - si_min) / (raw_max - raw_min)
+        else:
+            self._scale = None
+
+    def _struct_for(self, count):
+        try:
+            return self._structs[count]
+        except KeyError:
+            return self._structs.setdefault(count, struct.Struct(f'{self._byte_order}{count}{self._format_char}'))
+
     def _convert_single(self, value):
         return map_values(value, self._raw_min, self._raw_max, self._si_min, self._si_max)
 
     def convert(self, data):
-        type_info = self._type_info[self._dataType]
+        count = len(data) // self._data_size
+        values = self._struct_for(count).unpack_from(data)
 
-        values = []
-        for chunk in split(data, type_info.data_size):
-            (value,) = struct.unpack(type_info.read_pattern, chunk)
+        scale = self._scale
+        if scale is None:
+            return [self._convert_single(value) for value in values]
 
-            values.append(self._convert_single(value))
-
-        return values
+        raw_min = self._raw_min
+        si_min = self._si_min
+        return [(value - raw_min) * scale + si_min for value in values]
 
     def __str__(self) -> str:
         return f'Datasets: {self._nSamples}\n' \
@@ -71,6 +98,75 @@ class Ev3Mode:
                f'SI: {self._si_min}-{self._si_max}'
 
 
+class Ev3ModeCache:
+    """Mode tables of the EV3 sensor models that were seen before, keyed by the sensor type id
+
+    The raw mode info pages are kept in memory and in a StorageInterface, so they survive restarts when the storage
+    is a FileStorage."""
+
+    _default = None
+
+    @classmethod
+    def default(cls) -> 'Ev3ModeCache':
+        """The shared cache, stored in data/ev3_modes if that is writable, in memory otherwise"""
+        if cls._default is None:
+            try:
+                storage = FileStorage(os.path.join('data', 'ev3_modes'))
+            except StorageError:
+                get_logger('Ev3ModeCache')('Mode cache is not writable, using memory', LogLevel.WARNING)
+                storage = MemoryStorage()
+            cls._default = cls(storage)
+        return cls._default
+
+    def __init__(self, storage: StorageInterface):
+        self._storage = storage
+        self._modes = {}
+        self._lock = Lock()
+        self._log = get_logger('Ev3ModeCache')
+
+    @staticmethod
+    def _filename(sensor_type):
+        return f'sensor_{sensor_type}'
+
+    def get(self, sensor_type):
+        """The list of Ev3Mode objects of the sensor type, None if it is not cached"""
+        with self._lock:
+            try:
+                return self._modes[sensor_type]
+            except KeyError:
+                pass
+
+            try:
+                pages = self._storage.read(self._filename(sensor_type))
+            except StorageError:
+                return None
+
+            page_size = Ev3Mode.info_struct.size
+            if len(pages) % page_size != 0:
+                self._log(f'Ignoring invalid cached modes of sensor type {sensor_type}', LogLevel.WARNING)
+                return None
+
+            modes = [Ev3Mode.parse(pages[i:i + page_size]) for i in range(0, len(pages), page_size)]
+            self._modes[sensor_type] = modes
+            return modes
+
+    def put(self, sensor_type, pages):
+        """
+        Store the mode info pages of a sensor type
+
+        @param pages: the raw mode info pages, in mode order
+        @return: the parsed Ev3Mode list
+        """
+        modes = [Ev3Mode.parse(page) for page in pages]
+        with self._lock:
+            self._modes[sensor_type] = modes
+            try:
+                self._storage.write(self._filename(sensor_type), b''.join(pages))
+            except (IOError, StorageError) as e:
+                self._log(f'Failed to store modes of sensor type {sensor_type}: {e}', LogLevel.WARNING)
+        return modes
+
+
 class Ev3UARTSensor(BaseSensorPortDriver):
     STATE_RESET = 0
     STATE_CONFIGURE = 1
@@ -84,10 +180,12 @@ class Ev3UARTSensor(BaseSensorPortDriver):
         0x80: STATE_DATA
     }
 
-    def __init__(self, port: PortInstance, modes=None):
+    def __init__(self, port: PortInstance, modes=None, mode_cache: Ev3ModeCache = None):
         super().__init__('EV3', port)
         self._state = self.STATE_RESET
         self._modes = modes
+        self._mode_cache = mode_cache
+        self._discovery = None
         self._current_mode = 0
 
     def select_mode(self, mode):
@@ -103,13 +201,16 @@ class Ev3UARTSensor(BaseSensorPortDriver):
             state = self.REMOTE_STATES[raw[0] & self.REMOTE_STATUS_MASK]
 
             if self._state != state:
+                # set before discovery starts, the discovery thread checks it when it is done
+                self._state = state
                 if state == self.STATE_DATA:
                     if self._modes is None:
-                        self._modes = self._get_modes()
-                    self.on_configured()
-                self._state = state
+                        # this runs in a status updater handler, don't block it with the mode queries
+                        self._start_discovery()
+                    else:
+                        self.on_configured()
 
-            if state == self.STATE_DATA:
+            if state == self.STATE_DATA and self._modes is not None:
 
                 mode_idx = raw[0] & self.MODE_MASK
                 if mode_idx == self._current_mode:
@@ -126,20 +227,64 @@ class Ev3UARTSensor(BaseSensorPortDriver):
         except KeyError:
             return None
 
+    def _start_discovery(self):
+        if self._discovery is not None and self._discovery.is_alive():
+            return
+        self._discovery = Thread(target=self._discover_modes, name=f'Ev3Discovery{self._port.id}', daemon=True)
+        self._discovery.start()
+
+    def _discover_modes(self):
+        """
+        Runs on the discovery thread, so on_configured() and the on_status_changed callbacks of the first value are
+        called from this thread, too
+        """
+        try:
+            modes = self._get_modes()
+        except Exception as e:
+            self.log(f'Mode discovery failed: {e!r}', LogLevel.ERROR)
+            return
+
+        if modes is not None:
+            self._modes = modes
+            if self._state == self.STATE_DATA:
+                self.on_configured()
+
+            # the status updater only calls update_status() when the data changes, so a sensor with a steady
+            # reading would keep the value it had before discovery (None)
+            raw = self._raw_value
+            if raw is not None:
+                converted = self.convert_sensor_value(raw)
+                if converted is not None:
+                    self._value = converted
+                    self.on_status_changed(self._port)
+
     def _get_modes(self):
         sensor_info = self._interface.read_sensor_info(self._port.id, 0)
 
         if sensor_info:
             (sensor_type, speed, nModes, nViews) = struct.unpack('<blbb', sensor_info)
 
-            modes = []
-            for i in range(1, nModes+1):
-                mode_info = self._interface.read_sensor_info(self._port.id, i)
-                mode = Ev3Mode.parse(mode_info)
-                modes.append(mode)
-                self.log(f'New mode: {i}/{nModes}')
-                self.log(str(mode))
-                self.log('===============')
+            cache = self._mode_cache or Ev3ModeCache.default()
+            modes = cache.get(sensor_type)
+            if modes is not None:
+                self.log(f'Using cached modes of sensor type {sensor_type}')
+                return modes
+
+            # read every mode page under a single acquisition of the bus
+            with self._interface.batch() as batch:
+                for i in range(1, nModes+1):
+                    self._interface.read_sensor_info(self._port.id, i)
+
+            pages = []
+            for i, response in enumerate(batch.responses, start=1):
+                if response.status != ResponseStatus.Ok:
+                    raise ValueError(f'Reading mode {i} failed with status "{response.status}"')
+                pages.append(bytes(response.payload))
+
+            modes = cache.put(sensor_type, pages)
+            if self.log.is_enabled(LogLevel.DEBUG):
+                for i, mode in enumerate(modes, start=1):
+                    self.log(f'New mode: {i}/{nModes}\n{mode}', LogLevel.DEBUG)
 
             return modes
 
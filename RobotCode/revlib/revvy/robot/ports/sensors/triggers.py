@@ -0,0 +1,48 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+from revvy.utils.activation import Debouncer, EdgeTrigger
+
+
+class SensorTrigger:
+    """Calls back when a condition on the sensor value becomes true or false
+
+    The condition is evaluated on every sample, its result has to be stable for `debounce` samples before it is
+    accepted, and the callbacks are only called on the edges. The condition starts as false, so a value that already
+    meets it fires the rising edge callback on the first sample.
+
+    >>> trigger = threshold(50, on_above=lambda: print('above'), on_below=lambda: print('below'), debounce=2)
+    >>> for value in [10, 60, 10, 60, 60, 60, 40, 40]:
+    ...     trigger.handle(value)
+    above
+    below
+    """
+    def __init__(self, condition, on_rising=None, on_falling=None, debounce=1):
+        self._condition = condition
+        self._debouncer = Debouncer(debounce)
+        self._edge = EdgeTrigger()
+        self._edge.on_rising_edge(on_rising)
+        self._edge.on_falling_edge(on_falling)
+
+    def on_rising_edge(self, callback):
+        self._edge.on_rising_edge(callback)
+
+    def on_falling_edge(self, callback):
+        self._edge.on_falling_edge(callback)
+
+    def handle(self, value):
+        self._edge.handle(self._debouncer.handle(1 if self._condition(value) else 0))
+
+
+def threshold(limit, on_above=None, on_below=None, debounce=1) -> SensorTrigger:
+    """Fire when the value rises above or falls back to or below limit"""
+    return SensorTrigger(lambda value: value > limit, on_above, on_below, debounce)
+
+
+def in_range(low, high, on_enter=None, on_leave=None, debounce=1) -> SensorTrigger:
+    """Fire when the value enters or leaves the low <= value <= high range"""
+    return SensorTrigger(lambda value: low <= value <= high, on_enter, on_leave, debounce)
+
+
+def edge(on_rising=None, on_falling=None, debounce=1) -> SensorTrigger:
+    """Fire when the value becomes true or false, e.g. a bumper switch is pressed or released"""
+    return SensorTrigger(bool, on_rising, on_falling, debounce)
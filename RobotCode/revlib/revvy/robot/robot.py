@@ -167,6 +167,7 @@ class Robot(RobotInterface):
 
     def reset(self):
         self._log('reset()')
+        self._ring_led.invalidate()
         self._ring_led.start_animation(RingLed.BreathingGreen)
         self._status_updater.reset()
 
@@ -1,7 +1,11 @@
 # SPDX-License-Identifier: GPL-3.0-only
 
+import struct
+import time
+from threading import Condition
+
 from revvy.mcu.rrrc_control import RevvyControl
-from revvy.utils.logger import get_logger
+from revvy.utils.logger import get_logger, LogLevel
 
 
 class McuStatusUpdater:
@@ -26,28 +30,145 @@ class McuStatusUpdater:
 
     This class is the counterpart of McuStatusUpdater/McuStatusUpdaterWrapper implemented on the MCU and is used
     to enable and read specific data slots. It was designed to read multiple pieces of data in one run to decrease
-    communication interface overhead, thus to allow lower latency updates"""
+    communication interface overhead, thus to allow lower latency updates
+
+    Slots can be given a rate: their handler is then called at most that often and poll() only reads the MCU when
+    at least one slot is due. The data of slots that are not due is kept and handed over when they become due.
+
+    Every slot keeps the time of its last sample, the time of its last change, a change counter and the last raw data.
+    Handlers are only called when the raw data changes, except for the slots in every_sample_slots: the motor drivers
+    settle their position awaiters on the samples, and a repeated position request does not change the motor status.
+    Other threads can wait_for_sample() of a slot."""
+
+    every_sample_slots = frozenset(range(6))  # motor_1 .. motor_6
     def __init__(self, robot: RevvyControl):
         self._robot = robot
         self._is_enabled = [False] * 32
         self._is_enabled[self.mcu_updater_slots["reset"]] = True
         self._handlers = [None] * 32
+        self._decoders = [None] * 32  # struct.Struct of the slots whose handler gets unpacked values
+        self._every_sample = [slot in self.every_sample_slots for slot in range(32)]
+        self._layout = None  # see _compile()
+        self._intervals = [0.0] * 32  # [seconds] minimum time between two handler calls
+        self._next_due = [0.0] * 32
+        self._held = {}  # slot index -> data received while the slot was not due
+        self._clear_samples()
+        self._condition = Condition()
+        self._waiting = 0  # number of threads in wait_for_sample()
         self._log = get_logger('McuStatusUpdater')
 
+    def _clear_samples(self):
+        self._timestamps = [None] * 32  # time of the last sample
+        self._changed = [None] * 32  # time of the last change
+        self._sequence = [0] * 32  # number of changes
+        self._raw = [None] * 32  # raw data of the last sample
+        self._values = [None] * 32  # unpacked values of the last sample, for slots with a decoder
+
     def reset(self):
         self._log('reset all slots')
         self._is_enabled = [False] * 32
         self._is_enabled[self.mcu_updater_slots["reset"]] = True
         self._handlers = [None] * 32
+        self._decoders = [None] * 32
+        self._layout = None
+        self._next_due = [0.0] * 32
+        self._held.clear()
+        self._clear_samples()
         self._robot.status_updater_reset()
 
-    def enable_slot(self, slot, callback):
+    def set_slot_rate(self, slot, rate):
+        """
+        Limit how often the handler of a slot is called
+
+        @param slot: slot name
+        @param rate: updates per second, None or 0 to update on every read
+        """
+        slot_idx = self.mcu_updater_slots[slot]
+        self._intervals[slot_idx] = 1 / rate if rate else 0.0
+        self._next_due[slot_idx] = 0.0
+
+    def last_update(self, slot):
+        """time.monotonic() timestamp of the last sample of the slot, None if it was not updated yet"""
+        return self._timestamps[self.mcu_updater_slots[slot]]
+
+    def last_change(self, slot):
+        """time.monotonic() timestamp of the last sample that was different from the previous one"""
+        return self._changed[self.mcu_updater_slots[slot]]
+
+    def sequence(self, slot):
+        """Number of times the data of the slot has changed"""
+        return self._sequence[self.mcu_updater_slots[slot]]
+
+    def raw(self, slot):
+        """The raw data of the last sample, None if there was none"""
+        slot_idx = self.mcu_updater_slots[slot]
+        decoder = self._decoders[slot_idx]
+        if decoder is not None and self._values[slot_idx] is not None:
+            # decoded slots are not copied, only their values are kept
+            return decoder.pack(*self._values[slot_idx])
+        return self._raw[slot_idx]
+
+    def wait_for_sample(self, slot, newer_than, timeout=None):
+        """
+        Block until the slot has a sample received after newer_than
+
+        An other thread must keep reading the status, e.g. the robot loop calling read() or poll().
+
+        @param newer_than: time.monotonic() timestamp
+        @param timeout: [seconds] None to wait indefinitely
+        @return: the timestamp of the sample, or None if the timeout expired
+        """
+        slot_idx = self.mcu_updater_slots[slot]
+        timestamps = self._timestamps
+
+        def _has_new_sample():
+            timestamp = timestamps[slot_idx]
+            return timestamp is not None and timestamp > newer_than
+
+        with self._condition:
+            self._waiting += 1
+            try:
+                if self._condition.wait_for(_has_new_sample, timeout):
+                    return timestamps[slot_idx]
+                return None
+            finally:
+                self._waiting -= 1
+
+    def is_due(self, now=None):
+        """True if any slot with a handler is due to be updated"""
+        if now is None:
+            now = time.monotonic()
+
+        next_due = self._next_due
+        return any(handler is not None and next_due[slot] <= now for slot, handler in enumerate(self._handlers))
+
+    def poll(self):
+        """Read the MCU if any slot is due, return True if it was read"""
+        now = time.monotonic()
+        if self.is_due(now):
+            self.read(now)
+            return True
+        return False
+
+    def enable_slot(self, slot, callback, decoder: struct.Struct = None):
+        """
+        Enable a slot and set its handler
+
+        @param callback: called with the raw data of the slot, or with the unpacked values if decoder is given
+        @param decoder: the layout of the slot data, it is unpacked directly from the received buffer
+        """
         slot_idx = self.mcu_updater_slots[slot]
         if not self._is_enabled[slot_idx]:
             self._is_enabled[slot_idx] = True
             self._log(f'enable slot {slot_idx}')
             self._robot.status_updater_control(slot_idx, True)
+        if self._handlers[slot_idx] != callback or self._decoders[slot_idx] is not decoder:
+            # a new handler gets the current data, too
+            self._raw[slot_idx] = None
+            self._values[slot_idx] = None
         self._handlers[slot_idx] = callback
+        self._decoders[slot_idx] = decoder
+        self._layout = None
 
     def disable_slot(self, slot):
         slot_idx = self.mcu_updater_slots[slot]
@@ -56,17 +177,141 @@ class McuStatusUpdater:
             self._log(f'disable slot {slot_idx}')
             self._robot.status_updater_control(slot_idx, False)
         self._handlers[slot_idx] = None
+        self._decoders[slot_idx] = None
+        self._held.pop(slot_idx, None)
+        self._raw[slot_idx] = None
+        self._values[slot_idx] = None
+        self._layout = None
 
-    def read(self):
-        data = self._robot.status_updater_read()
+    def _compile(self, data):
+        """
+        Parse the slot headers of a response and remember the layout
+
+        Until the set of slots changes, the MCU sends the same layout, so the next reads only need to verify the
+        headers at the known offsets instead of walking the data.
 
+        @return: (header checks, dispatch entries), see read()
+        """
+        checks = []
+        entries = []
         idx = 0
         while idx < len(data):
-            data_start = idx + 2
-            slot, slot_length = data[idx:data_start]
-            idx = data_start + slot_length
-
-            handler = self._handlers[slot]
-            if handler:
-                # noinspection PyCallingNonCallable
-                handler(data[data_start:idx])
+            slot = data[idx]
+            length = data[idx + 1]
+            checks.append((idx, slot, length))
+            if self._handlers[slot]:
+                entries.append((slot, idx + 2, length))
+            idx += 2 + length
+
+        layout = (len(data), tuple(checks), tuple(entries))
+        self._layout = layout
+        return layout
+
+    def read(self, now=None):
+        """Read the MCU and call the handlers of the slots that are due"""
+        if now is None:
+            now = time.monotonic()
+
+        # data is a memoryview of the receive buffer, slots are decoded in place and only copied when changed
+        data = self._robot.status_updater_read()
+
+        layout = self._layout
+        if layout is not None and layout[0] == len(data):
+            for idx, slot, length in layout[1]:
+                if data[idx] != slot or data[idx + 1] != length:
+                    layout = self._compile(data)
+                    break
+        else:
+            layout = self._compile(data)
+
+        next_due = self._next_due
+        held = self._held
+        timestamps = self._timestamps
+        intervals = self._intervals
+        decoders = self._decoders
+        values = self._values
+        raw = self._raw
+        every_sample = self._every_sample
+        changed = []  # (slot, handler arguments, True if the data changed)
+        for slot, offset, length in layout[2]:
+            if next_due[slot] > now:
+                held[slot] = bytes(data[offset:offset + length])
+                continue
+
+            if held:
+                held.pop(slot, None)
+
+            # same as _update(), inlined for the common cases
+            timestamps[slot] = now
+            next_due[slot] = now + intervals[slot]
+            decoder = decoders[slot]
+            if decoder is None:
+                slot_data = data[offset:offset + length]
+                if slot_data == raw[slot]:
+                    if every_sample[slot]:
+                        changed.append((slot, (raw[slot], ), False))
+                    continue
+                raw[slot] = slot_data = bytes(slot_data)
+                changed.append((slot, (slot_data, ), True))
+            elif length == decoder.size:
+                args = decoder.unpack_from(data, offset)
+                if args == values[slot]:
+                    if every_sample[slot]:
+                        changed.append((slot, args, False))
+                    continue
+                values[slot] = args
+                changed.append((slot, args, True))
+            else:
+                self._log(f'Received {length} bytes of data in slot {slot} instead of {decoder.size}', LogLevel.WARNING)
+
+        if changed:
+            self._dispatch(changed, now)
+
+        # the MCU may not send a slot again until its data changes, so deliver what was held back
+        if held:
+            for slot in [slot for slot in held if next_due[slot] <= now]:
+                slot_data = held.pop(slot)
+                if self._handlers[slot]:
+                    self._update(slot, slot_data, 0, len(slot_data), now)
+
+        if self._waiting:
+            with self._condition:
+                self._condition.notify_all()
+
+    def _update(self, slot, data, offset, length, now):
+        self._timestamps[slot] = now
+        self._next_due[slot] = now + self._intervals[slot]
+
+        decoder = self._decoders[slot]
+        is_new = True
+        if decoder is None:
+            slot_data = data[offset:offset + length]
+            if slot_data == self._raw[slot]:
+                slot_data = self._raw[slot]
+                is_new = False
+            else:
+                self._raw[slot] = slot_data = bytes(slot_data)
+            args = (slot_data, )
+        elif length == decoder.size:
+            args = decoder.unpack_from(data, offset)
+            if args == self._values[slot]:
+                is_new = False
+            else:
+                self._values[slot] = args
+        else:
+            self._log(f'Received {length} bytes of data in slot {slot} instead of {decoder.size}', LogLevel.WARNING)
+            return
+
+        if is_new or self._every_sample[slot]:
+            self._dispatch(((slot, args, is_new), ), now)
+
+    def _dispatch(self, changed, now):
+        handlers = self._handlers
+        changed_at = self._changed
+        sequence = self._sequence
+        for slot, args, is_new in changed:
+            if is_new:
+                changed_at[slot] = now
+                sequence[slot] += 1
+            # noinspection PyCallingNonCallable
+            handlers[slot](*args)
@@ -0,0 +1,254 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+from array import array
+
+from revvy.robot.history import SignalHistory
+
+
+class TelemetryStore:
+    """Status values of a robot in a single preallocated array of doubles
+
+    The status updater handlers write the values in place, readers use the read-only views (motors, sensors,
+    acceleration, rotation, yaw, battery) or take a snapshot of the whole store with one buffer copy.
+
+    Signals can also keep a history (see history()), the status updater owner calls sample_histories() after every
+    read.
+
+    >>> store = TelemetryStore()
+    >>> store.motor_handler(1)(0, 50, 720, 75.0)
+    >>> store.motors[1].pos, store.motors[1].speed
+    (720, 75.0)
+    >>> store.snapshot()[TelemetryStore.MOTORS + TelemetryStore.MOTOR_FIELDS + 3]
+    75.0
+    """
+
+    motor_count = 6
+    sensor_count = 4
+
+    # offsets of the values
+    MOTORS = 0  # status, power, position, speed for every motor
+    MOTOR_FIELDS = 4
+    SENSORS = MOTORS + motor_count * MOTOR_FIELDS  # one value for every sensor, NaN if there is none
+    ACCELERATION = SENSORS + sensor_count  # x, y, z
+    ROTATION = ACCELERATION + 3  # x, y, z
+    YAW = ROTATION + 3  # yaw angle, relative yaw angle
+    BATTERY = YAW + 2  # charger status, main battery, motor battery
+    SIZE = BATTERY + 3
+
+    def __init__(self):
+        self._data = array('d', bytes(8 * self.SIZE))
+        for idx in range(self.sensor_count):
+            self._data[self.SENSORS + idx] = float('nan')
+
+        self.motors = tuple(MotorTelemetry(self._data, self.MOTORS + idx * self.MOTOR_FIELDS)
+                            for idx in range(self.motor_count))
+        self.sensors = tuple(SensorTelemetry(self._data, self.SENSORS + idx) for idx in range(self.sensor_count))
+        self.acceleration = VectorTelemetry(self._data, self.ACCELERATION)
+        self.rotation = VectorTelemetry(self._data, self.ROTATION)
+        self.yaw = YawTelemetry(self._data, self.YAW)
+        self.battery = BatteryTelemetry(self._data, self.BATTERY)
+
+        self._histories = {}  # signal name -> (offset, status updater slot, SignalHistory)
+
+    @property
+    def data(self):
+        """Read-only view of the whole store"""
+        return memoryview(self._data).toreadonly()
+
+    def snapshot(self) -> array:
+        """Copy of the whole store"""
+        return self._data[:]
+
+    def snapshot_into(self, buffer: array):
+        """Copy the whole store into a preallocated array('d') of SIZE elements"""
+        buffer[:] = self._data
+
+    def history(self, signal, length=64) -> SignalHistory:
+        """
+        Start keeping the history of a signal, or return its existing history
+
+        @param signal: a name from TelemetryStore.signals, e.g. 'motor_1.pos', 'sensor_2', 'axl.x', 'yaw'
+        @param length: number of samples to keep
+        """
+        try:
+            return self._histories[signal][2]
+        except KeyError:
+            offset, slot = self.signals[signal]
+            history = SignalHistory(length)
+            self._histories[signal] = (offset, slot, history)
+            return history
+
+    def drop_history(self, signal):
+        self._histories.pop(signal, None)
+
+    def sample_histories(self, last_update):
+        """
+        Append the current values to the histories of the signals that were sampled since the last call
+
+        A sample is appended even if the value did not change, so that the windows and differences are correct.
+
+        @param last_update: returns the time of the last sample of a status updater slot, see
+                            McuStatusUpdater.last_update()
+        """
+        data = self._data
+        for offset, slot, history in self._histories.values():
+            timestamp = last_update(slot)
+            if timestamp is not None and timestamp != history.last_time:
+                history.append(data[offset], timestamp)
+
+    # writers, used as status updater handlers
+
+    def motor_handler(self, motor_idx, callback=None):
+        """
+        Handler for the unpacked values of a motor slot (see DcMotorController.status_struct)
+
+        @param motor_idx: 0-based motor index
+        @param callback: called with the same values after they are stored
+        """
+        data = self._data
+        offset = self.MOTORS + motor_idx * self.MOTOR_FIELDS
+
+        def _update(status, power, pos, speed):
+            data[offset] = status
+            data[offset + 1] = power
+            data[offset + 2] = pos
+            data[offset + 3] = speed
+            if callback:
+                callback(status, power, pos, speed)
+
+        return _update
+
+    def sensor_handler(self, sensor_idx, sensor):
+        """
+        Handler for the raw data of a sensor slot
+
+        @param sensor: the sensor driver, its update_status() converts the data and its value is stored
+        """
+        def _update(data):
+            sensor.update_status(data)
+            self.set_sensor_value(sensor_idx, sensor.value)
+
+        return _update
+
+    def set_sensor_value(self, sensor_idx, value):
+        self._data[self.SENSORS + sensor_idx] = float('nan') if value is None else value
+
+    def set_vector(self, offset, x, y, z):
+        data = self._data
+        data[offset] = x
+        data[offset + 1] = y
+        data[offset + 2] = z
+
+    def set_yaw(self, yaw_angle, relative_yaw_angle):
+        self._data[self.YAW] = yaw_angle
+        self._data[self.YAW + 1] = relative_yaw_angle
+
+    def set_battery(self, charger_status, main, motor):
+        data = self._data
+        data[self.BATTERY] = charger_status
+        data[self.BATTERY + 1] = main
+        data[self.BATTERY + 2] = motor
+
+
+def _signals():
+    # signal name -> (offset, status updater slot)
+    signals = {}
+    for idx in range(TelemetryStore.motor_count):
+        slot = f'motor_{idx + 1}'
+        for field_idx, field in enumerate(('status', 'power', 'pos', 'speed')):
+            signals[f'{slot}.{field}'] = (TelemetryStore.MOTORS + idx * TelemetryStore.MOTOR_FIELDS + field_idx, slot)
+    for idx in range(TelemetryStore.sensor_count):
+        slot = f'sensor_{idx + 1}'
+        signals[slot] = (TelemetryStore.SENSORS + idx, slot)
+    for slot, offset in (('axl', TelemetryStore.ACCELERATION), ('gyro', TelemetryStore.ROTATION)):
+        for field_idx, field in enumerate('xyz'):
+            signals[f'{slot}.{field}'] = (offset + field_idx, slot)
+    signals['yaw'] = (TelemetryStore.YAW, 'yaw')
+    signals['yaw.relative'] = (TelemetryStore.YAW + 1, 'yaw')
+    for field_idx, field in enumerate(('charger_status', 'main', 'motor')):
+        signals[f'battery.{field}'] = (TelemetryStore.BATTERY + field_idx, 'battery')
+    return signals
+
+
+TelemetryStore.signals = _signals()
+
+
+class _TelemetryView:
+    __slots__ = ('_data', '_offset')
+
+    def __init__(self, data: array, offset):
+        self._data = data
+        self._offset = offset
+
+
+class MotorTelemetry(_TelemetryView):
+    __slots__ = ()
+
+    @property
+    def status(self):
+        return int(self._data[self._offset])
+
+    @property
+    def power(self):
+        return int(self._data[self._offset + 1])
+
+    @property
+    def pos(self):
+        return int(self._data[self._offset + 2])
+
+    @property
+    def speed(self):
+        return self._data[self._offset + 3]
+
+
+class SensorTelemetry(_TelemetryView):
+    __slots__ = ()
+
+    @property
+    def value(self):
+        """The converted sensor value, NaN if there is none"""
+        return self._data[self._offset]
+
+
+class VectorTelemetry(_TelemetryView):
+    __slots__ = ()
+
+    @property
+    def x(self):
+        return self._data[self._offset]
+
+    @property
+    def y(self):
+        return self._data[self._offset + 1]
+
+    @property
+    def z(self):
+        return self._data[self._offset + 2]
+
+
+class YawTelemetry(_TelemetryView):
+    __slots__ = ()
+
+    @property
+    def yaw_angle(self):
+        return int(self._data[self._offset])
+
+    @property
+    def relative_yaw_angle(self):
+        return int(self._data[self._offset + 1])
+
+
+class BatteryTelemetry(_TelemetryView):
+    __slots__ = ()
+
+    @property
+    def charger_status(self):
+        return int(self._data[self._offset])
+
+    @property
+    def main(self):
+        return int(self._data[self._offset + 1])
+
+    @property
+    def motor(self):
+        return int(self._data[self._offset + 2])
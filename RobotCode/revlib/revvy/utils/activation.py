@@ -21,6 +21,37 @@ class EdgeDetector:
             return 0
 
 
+class Debouncer:
+    """
+    Changes its output only after the input has kept the new value for `samples` consecutive samples
+
+    >>> db = Debouncer(2)
+    >>> print(", ".join(map(str, [db.handle(v) for v in [1, 0, 1, 1, 0, 0]])))
+    0, 0, 0, 1, 1, 0
+    """
+    def __init__(self, samples=1, initial=0):
+        self._samples = samples
+        self._value = initial
+        self._candidate = initial
+        self._count = 0
+
+    def handle(self, value):
+        if value == self._value:
+            self._count = 0
+        else:
+            if value == self._candidate:
+                self._count += 1
+            else:
+                self._candidate = value
+                self._count = 1
+
+            if self._count >= self._samples:
+                self._value = value
+                self._count = 0
+
+        return self._value
+
+
 class EdgeTrigger:
     def __init__(self):
         self._rising_edge = None
@@ -1,7 +1,8 @@
+import atexit
+import time
 from collections import deque
-from threading import Lock
-
-from revvy.utils.stopwatch import Stopwatch
+from queue import SimpleQueue
+from threading import Event, Thread, Lock
 
 _log_lock = Lock()
 
@@ -17,46 +18,114 @@ levels = ('Debug', 'Info', 'Warning', 'Error')
 
 
 class BaseLogger:
+    minimum_level = LogLevel.DEBUG
+
     def log(self, message, level):
         pass
 
+    def record(self, level, tag, message, args=()):
+        pass
+
     def flush(self):
         pass
 
 
 class Logger(BaseLogger):
+    """Prints log messages and keeps the last buffer_size of them for on_flush
+
+    Messages below minimum_level are dropped by the callers (see LogWrapper) before any string work is done. The
+    rest are put into a queue as (timestamp, level, tag, message, args) records, and a background thread formats
+    and prints them, so logging does not block on the console."""
+
     def __init__(self, buffer_size=1000):
-        self._sw = Stopwatch()
+        self._start_time = time.time()
         self._buffer = deque(maxlen=buffer_size)
         self.minimum_level = LogLevel.INFO
         self.on_flush = None
 
+        self._queue = SimpleQueue()
+        self._put = self._queue.put
+        self._writer = Thread(target=self._write_records, name='LogWriter', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
     def log(self, message, level=LogLevel.INFO):
         if level >= self.minimum_level:
-            message = f'{self._sw.elapsed} {levels[level]}: {message}'
-            print(message)
-            self._buffer.append(message + '\n')
-
-    def flush(self):
-        if self.on_flush:
-            self.on_flush(self._buffer)
-            self._buffer.clear()
+            self._put((time.time(), level, '', message, ()))
+
+    def record(self, level, tag, message, args=()):
+        """Queue a record, the level is not checked here. message % args is only done by the writer thread"""
+        self._put((time.time(), level, tag, message, args))
+
+    def _format(self, timestamp, level, tag, message, args):
+        if args:
+            try:
+                message = message % args
+            except (TypeError, ValueError) as e:
+                message = f'{message} {args!r} (formatting failed: {e})'
+        return f'{timestamp - self._start_time} {levels[level]}: {tag}{message}'
+
+    def _write_records(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+
+            if type(record) is Event:
+                # flush request
+                if self.on_flush:
+                    self.on_flush(self._buffer)
+                    self._buffer.clear()
+                record.set()
+            else:
+                message = self._format(*record)
+                print(message)
+                self._buffer.append(message + '\n')
+
+    def flush(self, timeout=1.0):
+        """Wait until the queued records are written, then pass the buffer to on_flush"""
+        if self._writer.is_alive():
+            done = Event()
+            self._put(done)
+            done.wait(timeout)
+
+    def close(self, timeout=1.0):
+        """Write the queued records and stop the writer thread"""
+        if self._writer.is_alive():
+            self._put(None)
+            self._writer.join(timeout)
 
 
 class LogWrapper(BaseLogger):
+    """Logger with a tag, forwards records to a base logger
+
+    The level is checked before anything else, so messages below the minimum level of the base logger cost a
+    comparison. Extra arguments are formatted into the message (message % args) only if it is written:
+
+        log('speed: %.1f', LogLevel.DEBUG, speed)
+    """
     def __init__(self, logger: BaseLogger, tag, default_log_level=LogLevel.INFO):
+        if isinstance(logger, LogWrapper):
+            # resolve the tag chain once instead of on every message
+            tag = logger._tag + tag
+            logger = logger._logger
+
         self._tag = tag + ': '
         self._logger = logger
         self._default_log_level = default_log_level
 
-    def log(self, message, level=None):
-        message = self._tag + message
+    def log(self, message, level=None, *args):
         if level is None:
             level = self._default_log_level
-        self._logger.log(message, level)
+        if level < self._logger.minimum_level:
+            return
+        self._logger.record(level, self._tag, message, args)
+
+    __call__ = log
 
-    def __call__(self, message, level=None):
-        self.log(message, level)
+    def is_enabled(self, level):
+        """Check before doing expensive work that is only needed for the log message"""
+        return level >= self._logger.minimum_level
 
     def flush(self):
         self._logger.flush()
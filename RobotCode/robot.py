@@ -4,8 +4,7 @@ from time import sleep
 import os
 
 from revlib.revvy.robot.led_ring import RingLed
-
-from smbus2 import SMBus
+from revvy.robot.ports.sensors import triggers
 
 import time
 from networktables import NetworkTables
@@ -42,27 +41,37 @@ class MyRobot(revlib.RevBot):
         self.bumper = self.get_sensor(robotmap.BUMPER, 'bumper_switch')
         self.ultra = self.get_sensor(robotmap.ULTRA, 'hcsr04')
 
+        self.bumper_trigger = None
+
+    def on_bumper_pressed(self):
+        print("BUMPER: True")
+        self.set_led_color(0xffff00)
+
+    def on_bumper_released(self):
+        print("BUMPER: False")
+        self.set_led_color(0xB333FF)
+
     def autonomousInit(self):
         #self.myRobot.tankDrive(0.8, 0.8)
-        pass
+
+        # the LED only changes when the bumper does, not every loop
+        self.set_led_color(0xffff00 if self.bumper.value else 0xB333FF)
+        if self.bumper_trigger is None:
+            self.bumper_trigger = self.add_sensor_trigger(self.bumper, triggers.edge(
+                on_rising=self.on_bumper_pressed, on_falling=self.on_bumper_released, debounce=2))
 
     def autonomousPeriodic(self):
         #self.myRobot.tankDrive(1, 0.5)
 
-        if(self.bumper.value):
-            self.set_led_color(0xffff00)
-
-        if not self.bumper.value:
-            self.set_led_color(0xB333FF)
-
-        print(f"BUMPER: {self.bumper.value}")
         print(f"ULTRA: {self.ultra.value}")
 
     def teleopInit(self):
         """
         Configures appropriate robot settings for teleop mode
         """
-        pass
+        if self.bumper_trigger is not None:
+            self.bumper.remove_trigger(self.bumper_trigger)
+            self.bumper_trigger = None
         
     def deadzone(self, val, deadzone):
         if abs(val) < deadzone:
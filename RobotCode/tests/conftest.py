@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the robot code imports revlib, and revlib imports revvy with absolute imports
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[0:0] = [_root, os.path.join(_root, 'revlib')]
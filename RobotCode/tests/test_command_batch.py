@@ -0,0 +1,30 @@
+import unittest
+
+from revvy.hardware_dependent.rrrc_transport_sim import RevvyTransportSimDevice, SimulatedMcu
+from revvy.mcu.rrrc_transport import RevvyTransport
+
+
+class TestNestedCommandBatch(unittest.TestCase):
+    def test_inner_batch_is_sent_with_the_outer_one(self):
+        transport = RevvyTransport(RevvyTransportSimDevice(SimulatedMcu()))
+        sent = []
+        send_commands = transport.send_commands
+
+        def record(commands):
+            sent.append([command for command, *_ in commands])
+            return send_commands(commands)
+        transport.send_commands = record
+
+        with transport.batch() as outer:
+            transport.send_command(0x33)
+            with transport.batch():
+                transport.send_command(0x3B)
+            self.assertEqual([], sent)
+            transport.send_command(0x3C)
+
+        self.assertEqual([[0x33, 0x3B, 0x3C]], sent)
+        self.assertEqual(3, len(outer.responses))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import time
+import unittest
+
+import revlib
+from revvy.hardware_dependent.rrrc_transport_sim import RevvyTransportSim
+from revvy.utils.awaiter import AwaiterSignal
+
+
+class TestDcMotorPositionRequest(unittest.TestCase):
+    def _wait_for(self, bot, awaiter, timeout=2.0):
+        end = time.monotonic() + timeout
+        while awaiter.state == AwaiterSignal.NONE and time.monotonic() < end:
+            bot.update_status()
+            time.sleep(0.005)
+        return awaiter.state
+
+    def test_repeated_position_request_finishes(self):
+        bot = revlib.RevBot(bus_factory=RevvyTransportSim)
+        try:
+            motor = bot.get_motor('motor_1')
+
+            self.assertEqual(AwaiterSignal.FINISHED, self._wait_for(bot, motor.set_position(0)))
+            # the MCU status of the second request is identical to the first one
+            self.assertEqual(AwaiterSignal.FINISHED, self._wait_for(bot, motor.set_position(0)))
+        finally:
+            bot.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
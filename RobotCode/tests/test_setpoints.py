@@ -0,0 +1,32 @@
+import threading
+import unittest
+
+from revvy.robot.ports.motors.setpoints import MotorSetpointCache
+
+
+class FakeInterface:
+    def __init__(self):
+        self.sent = []
+
+    def set_motor_port_control_value(self, frame):
+        self.sent.append(bytes(frame))
+
+
+class TestMotorSetpointCacheMerge(unittest.TestCase):
+    def test_merge_does_not_hold_back_other_threads(self):
+        interface = FakeInterface()
+        cache = MotorSetpointCache(interface)
+
+        with cache.merge():
+            cache.request(0, b'\x00\x01')
+            thread = threading.Thread(target=cache.request, args=(1, b'\x01\x01'))
+            thread.start()
+            thread.join()
+            # the other thread's request is sent right away
+            self.assertEqual([b'\x01\x01'], interface.sent)
+
+        self.assertEqual([b'\x01\x01', b'\x00\x01'], interface.sent)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import time
+from array import array
+
+
+class LoopProfiler:
+    def __init__(self, phases, window=256):
+        '''Times the phases of a loop and keeps the last `window`
+           durations of each phase for percentiles:
+
+               profiler.start()        # once, before the loop
+               status()
+               profiler.mark('status') # time since the previous mark
+               periodic()
+               profiler.mark('periodic')
+
+           A mark costs a clock read and an array store, the
+           percentiles are only computed when they are asked for.
+        '''
+        self.phases = list(phases)
+        self.window = window
+        self._samples = {phase: array('q', bytes(8 * window)) for phase in self.phases}
+        self._last = {phase: 0 for phase in self.phases}
+        self._counts = {phase: 0 for phase in self.phases}
+        self._previous = None
+
+    def start(self):
+        self._previous = time.perf_counter_ns()
+
+    def mark(self, phase):
+        now = time.perf_counter_ns()
+        duration = now - self._previous
+        self._previous = now
+        self._add(phase, duration)
+
+    def split(self, phase, part, part_duration):
+        '''Like mark(phase), but part_duration seconds of the time
+           since the previous mark are counted as `part`, e.g. the
+           bus time of the motor commands sent during periodic().
+        '''
+        now = time.perf_counter_ns()
+        duration = now - self._previous
+        self._previous = now
+
+        part_ns = min(max(int(part_duration * 1e9), 0), duration)
+        self._add(part, part_ns)
+        self._add(phase, duration - part_ns)
+
+    def _add(self, phase, duration):
+        count = self._counts[phase]
+        self._samples[phase][count % self.window] = duration
+        self._counts[phase] = count + 1
+        self._last[phase] = duration
+
+    def skip(self):
+        '''Don't count the time since the previous mark in any phase.'''
+        self._previous = time.perf_counter_ns()
+
+    def last(self):
+        '''Duration of the latest sample of each phase, in seconds.'''
+        return {phase: duration / 1e9 for phase, duration in self._last.items()}
+
+    def percentiles(self):
+        '''p50, p95, p99 and max of each phase over the window, in
+           seconds. Phases without samples are left out.
+        '''
+        result = {}
+        for phase in self.phases:
+            n = min(self._counts[phase], self.window)
+            if not n:
+                continue
+            samples = sorted(self._samples[phase][0:n])
+            result[phase] = {
+                'p50': samples[(n - 1) * 50 // 100] / 1e9,
+                'p95': samples[(n - 1) * 95 // 100] / 1e9,
+                'p99': samples[(n - 1) * 99 // 100] / 1e9,
+                'max': samples[-1] / 1e9,
+            }
+        return result
+
+    def publish(self, table):
+        '''Put the percentiles into a NetworkTables table, as
+           <phase>/<statistic> entries in milliseconds.
+        '''
+        for phase, stats in self.percentiles().items():
+            for name, value in stats.items():
+                table.putNumber(f'{phase}/{name}', value * 1000)
+
+    def dump(self):
+        lines = [f'{"phase":<10}{"p50":>9}{"p95":>9}{"p99":>9}{"max":>9}  [ms]']
+        for phase, stats in self.percentiles().items():
+            lines.append(f'{phase:<10}' + ''.join(f'{stats[name] * 1000:9.3f}' for name in ('p50', 'p95', 'p99', 'max')))
+        return '\n'.join(lines)
+
+    def reset(self):
+        for phase in self.phases:
+            self._counts[phase] = 0
+            self._last[phase] = 0
@@ -1,6 +1,8 @@
 # python run.py robot.py
 
 import traceback
+import argparse
+import contextlib
 
 #Networking and Logging
 import logging
@@ -12,11 +14,15 @@ import sys
 import threading
 import time
 import random
+import queue
 
 
 from networktables import NetworkTables
 
 import buffer
+import scheduler
+from profiler import LoopProfiler
+from telemetry_publisher import TelemetryPublisher
 #Robot
 #import robot
 import pikitlib
@@ -27,18 +33,28 @@ logging.basicConfig(level=logging.ERROR)
 MODE_COLORS = {'Teleop':0x6600cc, 'Auton':0x6600cc}
 DISABLE_COLOR = 0xff0000
 ENABLE_COLOR = 0x00ff00
+DISABLED_PERIOD = 0.1  # [s] robot loop period while disabled
 
 class main():
-    def __init__(self):
+    def __init__(self, simulate=False, bus_worker=False, record=None, loop_scheduler=None):
         """
         Construct robot disconnect, and powered on
         """
         self.r = None
+        self.simulate = simulate
+        self.bus_worker = bus_worker
+        self.record = record
         self.current_mode = ""
         self.disabled = True
+        # NetworkTables changes, handled on the robot loop thread in the order they arrived
+        self.events = queue.SimpleQueue()
+        # arrival time and latency of the last controller input, see controllerChanged()
+        self.input_time = None
+        self.input_latency = 0
         
-        
-        self.timer = pikitlib.Timer()
+        # runs robotLoop every 20 ms
+        self.scheduler = loop_scheduler or scheduler.PeriodicScheduler(0.02)
+        self.profiler = LoopProfiler(['status', 'publish', 'periodic', 'motors', 'sleep'])
         self.connectedIP = None
         self.isRunning = False
 
@@ -50,7 +66,17 @@ class main():
             dir = os.path.dirname(os.path.realpath(__file__))
             sys.path.append(f'{dir}/RobotCode')
             from RobotCode.robot import MyRobot
-            self.r = MyRobot()
+            recorder = None
+            if self.record:
+                from revvy.mcu.flight_recorder import FlightRecorder
+                recorder = FlightRecorder(self.record)
+
+            if self.simulate:
+                from revvy.hardware_dependent.rrrc_transport_sim import RevvyTransportSim
+                self.r = MyRobot(bus_factory=lambda: RevvyTransportSim(worker=self.bus_worker, recorder=recorder))
+            else:
+                from revvy.hardware_dependent.rrrc_transport_i2c import RevvyTransportI2C
+                self.r = MyRobot(bus_factory=lambda: RevvyTransportI2C(1, worker=self.bus_worker, recorder=recorder))
 
             return True
         except Exception as e:
@@ -68,6 +94,10 @@ class main():
         """
         NetworkTables.initialize()
         NetworkTables.addConnectionListener(self.connectionListener, immediateNotify=True)
+        self.diagnostics_nt = NetworkTables.getTable("Diagnostics")
+        self.diagnostics_nt.addEntryListener(self.diagnosticsChanged, key="Dump")
+        NetworkTables.getTable("DriverStation/XboxController0").addEntryListener(self.controllerChanged,
+                                                                                 key="Sequence")
 
 
     def connectionListener(self, connected, info):
@@ -85,12 +115,80 @@ class main():
         Check for new changes and use them
         """
         #print("valueChanged: key: '%s'; value: %s; isNew: %s" % (key, value, isNew))
-        if(key == "Mode"):
-            self.setupMode(value)
-        if(key == "Disabled"):
-            self.disabled = value
         if(key == "ESTOP"):
+            # not queued: the robot loop stops at the end of its cycle, quit() then stops the motors
+            self.stop_threads = True
             self.quit()
+            return
+        # this runs on the NetworkTables thread, the robot loop applies the change
+        self.events.put((key, value))
+
+    def handleEvent(self, key, value):
+        """
+        Apply a mode change, on the robot loop thread
+        """
+        if(key == "Mode"):
+            if value != self.current_mode:
+                self.setupMode(value)
+        if(key == "Disabled"):
+            if value != self.disabled:
+                self.disabled = value
+                if value:
+                    self.disable()
+                else:
+                    # need to physically enable the bot
+                    self.enable()
+                    self.scheduler.resync()
+
+    def processEvents(self, timeout=None):
+        """
+        Apply the queued changes. If there are none, wait for one
+        at most timeout seconds. Returns True if there was any.
+        """
+        try:
+            event = self.events.get(timeout=timeout) if timeout else self.events.get_nowait()
+        except queue.Empty:
+            return False
+
+        while True:
+            self.handleEvent(*event)
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                return True
+
+    def diagnosticsChanged(self, table, key, value, isNew):
+        """
+        Setting Diagnostics/Dump to true logs the loop timings
+        """
+        if value:
+            self.dumpDiagnostics()
+            table.putBoolean("Dump", False)
+
+    def controllerChanged(self, table, key, value, isNew):
+        """
+        The driver station increments Sequence with every joystick
+        update, including a heartbeat while the input is unchanged
+        """
+        self.input_time = time.monotonic()
+        # needs the clocks of the driver station and the robot to be in sync
+        self.input_latency = time.time() - table.getNumber("Timestamp", 0)
+
+    def dumpDiagnostics(self):
+        logging.info("Robot loop timings:\n%s\nscheduler: %s", self.profiler.dump(), self.scheduler.stats())
+
+    def publishDiagnostics(self):
+        loop_nt = self.diagnostics_nt.getSubTable("Loop")
+        self.profiler.publish(loop_nt)
+        stats = self.scheduler.stats()
+        loop_nt.putNumber("jitter/max", stats['jitter']['max'] * 1000)
+        loop_nt.putNumber("overruns", stats['overruns']['count'])
+        loop_nt.putNumber("skipped", stats['skipped'])
+
+        input_nt = self.diagnostics_nt.getSubTable("Input")
+        if self.input_time is not None:
+            input_nt.putNumber("age", (time.monotonic() - self.input_time) * 1000)
+            input_nt.putNumber("latency", self.input_latency * 1000)
 
     def setupLogging(self):
         rootLogger = logging.getLogger('')
@@ -142,30 +240,38 @@ class main():
         
     def disable(self):
         if not self.r.disabled:
-            self.r.disable()
-            self.r.set_led_color(DISABLE_COLOR)
+            with self.r.batch():
+                self.r.disable()
+                self.r.set_led_color(DISABLE_COLOR)
 
     def enable(self):
         if self.r.disabled:
-            self.r.enable()
-            self.r.set_led_color(MODE_COLORS.get(self.current_mode,ENABLE_COLOR))
+            with self.r.batch():
+                self.r.enable()
+                self.r.set_led_color(MODE_COLORS.get(self.current_mode,ENABLE_COLOR))
 
     def setupBatteryLogger(self):
         self.battery_nt = NetworkTables.getTable('Battery')
+        self.telemetry = TelemetryPublisher(self.r.telemetry, NetworkTables.getTable('Telemetry'),
+                                            self.r.TELEMETRY_RATES, flush=NetworkTables.flush)
 
         # Todo: get battery from revlib
         #self.ai = pikitlib.analogInput(2)
        
 
     def sendBatteryData(self):
-        self.r.update_status()
         self.battery_nt.putNumber("Voltage", self.r.battery)
 
     def quit(self):
         logging.info("Quitting...")
         self.stop_threads = True
-        self.rl.join() 
-        self.disable()
+        if threading.current_thread() is not self.rl:
+            self.rl.join()
+        # the loop may have sent setpoints after it was last disabled, stop the motors regardless
+        with self.r.batch():
+            self.r.disable()
+            self.r.set_led_color(DISABLE_COLOR)
+        self.r.close()
         sys.exit()
 
     def catchErrorAndLog(self, err, logErr=True):
@@ -190,52 +296,94 @@ class main():
     def robotLoop(self, stop):
         bT = pikitlib.Timer() 
         bT.start()
+        dT = pikitlib.Timer()
+        dT.start()
+        profiler = self.profiler
+        self.scheduler.start()
+        self.disable()
+        profiler.start()
         while not stop():
-            
+
+            if self.processEvents():
+                profiler.skip()
+
+            # reads only the status slots that are due, see RevBot.STATUS_RATES
+            self.r.update_status()
+            profiler.mark('status')
+
             if bT.get() > 0.2:
                 self.sendBatteryData()
                 bT.reset()
-
-            if not self.disabled:
-               
-                # need to physically enable the bot
-                # if it was previously disabled
-                self.enable()
-
-                self.timer.start()
+            self.telemetry.publish()
+            if dT.get() > 1:
+                self.publishDiagnostics()
+                dT.reset()
+            profiler.mark('publish')
+
+            if self.disabled:
+                # idle at a low rate, but wake up for the next mode change
+                profiler.skip()
+                self.processEvents(DISABLED_PERIOD)
+                profiler.skip()
+            else:
+                # the bus time of the motor commands is counted as 'motors', the rest as 'periodic'
+                motor_bus_time = self.r.motor_bus_time
                 try:
-                    if self.current_mode == "Auton":
-                        self.auton()
-                    elif self.current_mode == "Teleop":
-                        self.teleop()
+                    # with RevBot.MERGE_PERIODIC_MOTOR_COMMANDS the motor setpoints are sent together at the end
+                    if self.r.MERGE_PERIODIC_MOTOR_COMMANDS:
+                        periodic_block = self.r.merge_motor_commands()
+                    else:
+                        periodic_block = contextlib.nullcontext()
+                    with periodic_block:
+                        if self.current_mode == "Auton":
+                            self.auton()
+                        elif self.current_mode == "Teleop":
+                            self.teleop()
                 except Exception as e:
                     self.catchErrorAndLog(e)
                     break
-                self.timer.stop()
-                ts = 0.02 -  self.timer.get()
-                
-                self.timer.reset()
-                if ts < -0.5:
+                profiler.split('periodic', 'motors', self.r.motor_bus_time - motor_bus_time)
+
+                # the next cycle starts on the 20 ms grid, not 20 ms after this one ended
+                overrun = self.scheduler.wait()
+                profiler.mark('sleep')
+                if overrun > 0.5:
                     logging.critical("Program taking too long!")
                     self.quit()
-                elif ts < 0:
-                    logging.warning("%s has slipped by %s miliseconds!", self.current_mode, ts * -1000)
-                else:        
-                    time.sleep(ts)
-            else:
-                self.disable()
+                elif overrun > 0:
+                    last = profiler.last()
+                    logging.warning("%s has slipped by %s miliseconds! (status %.1f ms, periodic %.1f ms, motors %.1f ms)",
+                                    self.current_mode, overrun * 1000,
+                                    last['status'] * 1000, last['periodic'] * 1000, last['motors'] * 1000)
 
         self.disable()
 
             
 
     def debug(self):
-        self.disabled = False
         self.start()
-        self.setupMode("Teleop")
-
-    
-m = main()
+        self.events.put(("Disabled", False))
+        self.events.put(("Mode", "Teleop"))
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sim", action="store_true", help="run against a simulated MCU instead of the robot brain")
+parser.add_argument("--bus-worker", action="store_true",
+                    help="send MCU commands from a separate thread, motor commands first")
+parser.add_argument("--record", metavar="FILE",
+                    help="record MCU traffic into a ring file, decode it with python -m revvy.mcu.flight_recorder")
+parser.add_argument("--catch-up", action="store_true",
+                    help="run the robot loop cycles missed after an overrun back to back instead of skipping them")
+parser.add_argument("--rt-priority", type=int, metavar="PRIORITY",
+                    help="run the robot loop with this SCHED_FIFO real-time priority (needs permission)")
+parser.add_argument("--cpu", type=int, action="append", metavar="CPU",
+                    help="pin the robot loop to this CPU, can be given more than once")
+args = parser.parse_args()
+
+loop_scheduler = scheduler.PeriodicScheduler(0.02,
+                                             policy=scheduler.CATCH_UP if args.catch_up else scheduler.SKIP,
+                                             priority=args.rt_priority, cpus=args.cpu)
+m = main(simulate=args.sim, bus_worker=args.bus_worker, record=args.record, loop_scheduler=loop_scheduler)
 m.connect()
 
 if m.tryToSetupCode():
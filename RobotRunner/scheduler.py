@@ -0,0 +1,158 @@
+import logging
+import os
+import time
+
+CATCH_UP = 'catch-up'
+SKIP = 'skip'
+
+
+class Histogram:
+    def __init__(self, edges_us=(50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000)):
+        '''Counts durations into bins. The bin edges are in
+           microseconds, the last bin counts everything above them.
+        '''
+        self.edges = [edge * 1000 for edge in edges_us]
+        self.labels = [f'<{edge}us' for edge in edges_us] + [f'>={edges_us[-1]}us']
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.edges) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, duration_ns):
+        idx = 0
+        for edge in self.edges:
+            if duration_ns < edge:
+                break
+            idx += 1
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += duration_ns
+        if duration_ns > self.max:
+            self.max = duration_ns
+
+    def as_dict(self):
+        '''Bin counts by label, plus count, mean and max in seconds.'''
+        result = dict(zip(self.labels, self.counts))
+        result['count'] = self.count
+        result['mean'] = self.total / self.count / 1e9 if self.count else 0.0
+        result['max'] = self.max / 1e9
+        return result
+
+
+class PeriodicScheduler:
+    def __init__(self, period=0.02, policy=SKIP, spin=0.0002, max_catch_up=5, priority=None, cpus=None):
+        '''Runs a loop on a fixed grid of time.monotonic_ns() deadlines,
+           so the period does not drift with the time the work takes:
+
+               scheduler.start()
+               while running:
+                   work()
+                   overrun = scheduler.wait()
+
+           When a cycle runs past its deadline, the policy decides:
+             CATCH_UP: the missed cycles run back to back, without
+                       sleeping, at most max_catch_up of them
+             SKIP:     the missed cycles are dropped, the loop waits
+                       for the next deadline on the grid
+
+           wait() sleeps until shortly before the deadline and spins
+           for the last `spin` seconds, to wake up on time.
+           priority (SCHED_FIFO priority) and cpus (CPU affinity) are
+           applied to the thread that calls start(), if permitted.
+        '''
+        if policy not in (CATCH_UP, SKIP):
+            raise ValueError(f'Unknown policy: {policy}')
+
+        self.period_ns = int(period * 1e9)
+        self.policy = policy
+        self.spin_ns = int(spin * 1e9)
+        self.max_catch_up = max_catch_up
+        self.priority = priority
+        self.cpus = cpus
+
+        self.jitter = Histogram()  # how late the loop wakes up after the deadline
+        self.overruns = Histogram()  # how far the work runs past the deadline
+        self.skipped = 0  # cycles dropped by SKIP or by the catch up limit
+        self._deadline = None
+
+    def start(self):
+        self._apply_thread_settings()
+        self._deadline = time.monotonic_ns() + self.period_ns
+
+    def resync(self):
+        '''Start the grid over from now, e.g. after the loop was
+           paused, so the pause does not count as an overrun.
+        '''
+        self._deadline = time.monotonic_ns() + self.period_ns
+
+    def _apply_thread_settings(self):
+        if self.cpus:
+            try:
+                os.sched_setaffinity(0, self.cpus)
+            except (AttributeError, OSError) as e:
+                logging.warning("Could not set CPU affinity to %s: %s", self.cpus, e)
+
+        if self.priority:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+            except (AttributeError, OSError) as e:
+                logging.warning("Could not set real-time priority %s: %s", self.priority, e)
+
+    def wait(self):
+        '''Wait for the next cycle. Returns how many seconds the
+           finished cycle ran past its deadline, 0 if it did not.
+        '''
+        if self._deadline is None:
+            self.start()
+
+        deadline = self._deadline
+        period = self.period_ns
+        now = time.monotonic_ns()
+
+        if now >= deadline:
+            overrun = now - deadline
+            self.overruns.add(overrun)
+
+            missed = overrun // period
+            if self.policy == SKIP:
+                self.skipped += missed + 1
+                start = deadline + (missed + 1) * period
+                self._sleep_until(start)
+                self._deadline = start + period
+            elif missed >= self.max_catch_up:
+                # too far behind to catch up, start over from now
+                self.skipped += missed
+                self._deadline = now + period
+            else:
+                # run the next cycle right away
+                self._deadline = deadline + period
+            return overrun / 1e9
+
+        self._sleep_until(deadline)
+        self._deadline = deadline + period
+        return 0.0
+
+    def _sleep_until(self, deadline):
+        remaining = deadline - time.monotonic_ns() - self.spin_ns
+        if remaining > 0:
+            time.sleep(remaining / 1e9)
+
+        now = time.monotonic_ns()
+        while now < deadline:
+            now = time.monotonic_ns()
+        self.jitter.add(now - deadline)
+
+    def stats(self):
+        return {
+            'jitter': self.jitter.as_dict(),
+            'overruns': self.overruns.as_dict(),
+            'skipped': self.skipped,
+        }
+
+    def reset_stats(self):
+        self.jitter.reset()
+        self.overruns.reset()
+        self.skipped = 0
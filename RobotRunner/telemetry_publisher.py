@@ -0,0 +1,87 @@
+import time
+from array import array
+
+# groups of TelemetryStore signals by name prefix
+GROUPS = {
+    'motors': ('motor_',),
+    'sensors': ('sensor_',),
+    'imu': ('axl.', 'gyro.', 'yaw'),
+    'battery': ('battery.',),
+}
+
+
+def resolve(name, signals):
+    '''Signal names of a group ('motors'), a slot ('motor_1') or a
+       single signal ('motor_1.speed'), in TelemetryStore order.
+    '''
+    if name in GROUPS:
+        prefixes = GROUPS[name]
+        return [signal for signal in signals if signal.startswith(prefixes)]
+    return [signal for signal in signals if signal == name or signal.startswith(name + '.')]
+
+
+class TelemetryPublisher:
+    def __init__(self, store, table, rates, flush=None):
+        '''Publishes robot signals from a TelemetryStore into a
+           NetworkTables table, one number array per entry of rates:
+
+               rates = {'motors': 10, 'imu': 25, 'sensor_2': 50}
+
+           A key is a group (see GROUPS), a status slot or a signal
+           name, the value is the maximum number of updates per
+           second. The names of the values of each array are put
+           once into <key>/names.
+
+           publish() takes one snapshot of the store, puts only the
+           arrays that are due and changed, then calls flush (e.g.
+           NetworkTables.flush) once if anything was put.
+        '''
+        self._store = store
+        self._table = table
+        self._flush = flush
+        self._snapshot = array('d', bytes(8 * store.SIZE))
+
+        self._entries = []
+        for key, rate in rates.items():
+            names = resolve(key, store.signals)
+            if not names:
+                raise ValueError(f'Unknown telemetry signal or group: {key}')
+            offsets = [store.signals[name][0] for name in names]
+            if offsets == list(range(offsets[0], offsets[0] + len(offsets))):
+                # contiguous in the store, copied with one slice
+                indices = slice(offsets[0], offsets[0] + len(offsets))
+            else:
+                indices = offsets
+            table.putStringArray(f'{key}/names', names)
+            self._entries.append([key, indices, 1 / rate if rate else 0.0, 0.0, None])
+
+    def publish(self, now=None):
+        '''Put the due signals, returns the number of arrays put.'''
+        if now is None:
+            now = time.monotonic()
+
+        snapshot = self._snapshot
+        self._store.snapshot_into(snapshot)
+
+        put = 0
+        for entry in self._entries:
+            key, indices, interval, next_time, last = entry
+            if now < next_time:
+                continue
+            entry[3] = now + interval
+
+            if type(indices) is slice:
+                values = snapshot[indices]
+            else:
+                values = array('d', [snapshot[idx] for idx in indices])
+
+            # compared as bytes, so that NaN (no sensor data) equals itself
+            packed = values.tobytes()
+            if packed != last:
+                self._table.putNumberArray(key, values.tolist())
+                entry[4] = packed
+                put += 1
+
+        if put and self._flush:
+            self._flush()
+        return put